@@ -99,10 +99,48 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "OPTIONS": {
+            # transactions take the write lock first and wait for it, a
+            # read then write would fail at once when another one writes
+            "transaction_mode": "IMMEDIATE",
+            "timeout": 20,
+        },
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+# shared by all gunicorn workers, so that invalidations reach every worker
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "cache",
+        "OPTIONS": {
+            "MAX_ENTRIES": 5000,
+        },
+    },
+    # per gunicorn worker, for rendered template fragments
+    "fragments": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "fragments",
+        "OPTIONS": {
+            "MAX_ENTRIES": 5000,
+        },
+    },
+}
+
+# full-page cache for anonymous visitors, see main.caching
+PAGE_CACHE_ALIAS = "default"
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24  # 1 day in seconds
+# seconds between writes of the hit and miss counters of each process
+PAGE_CACHE_STATS_INTERVAL = 60
+# part of page cache keys and validators, so that pages rendered by the
+# code of a previous deploy are not served again
+DEPLOY_VERSION = os.environ.get("DEPLOY_VERSION", "")
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -139,6 +177,26 @@ USE_TZ = True
 
 STATIC_URL = "/static/"
 STATIC_ROOT = os.path.join(BASE_DIR, "static")
+
+# Media files (uploaded images)
+# https://docs.djangoproject.com/en/6.0/topics/files/
+
+MEDIA_URL = "/media/"
+MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+
+# let Caddy serve image files, see ansible/chaitinschool.caddy.j2
+IMAGES_ACCEL_REDIRECT = os.environ.get("IMAGES_ACCEL_REDIRECT") == "1"
+
+# feeds are also written here, for Caddy to serve them without the app
+FEEDS_ROOT = os.path.join(MEDIA_ROOT, "feeds")
+FEEDS_WRITE_FILES = os.environ.get("FEEDS_WRITE_FILES") == "1"
+
+# uploads of bigger images are rejected while they are being received
+IMAGE_UPLOAD_MAX_SIZE = 1000 * 1000
+
+# processes generating thumbnails and WebP/AVIF copies of uploads
+IMAGE_VARIANT_WORKERS = 2
+
 STORAGES = {
     "default": {
         "BACKEND": "django.core.files.storage.FileSystemStorage",
@@ -172,3 +230,10 @@ EMAIL_SUBJECT_PREFIX = "[chaitin] "
 # Email extra options for broadcasts
 EMAIL_BROADCAST_PREVIEW = "zf@sirodoht.com"
 EMAIL_POSTMARK_HEADER = "broadcast"
+# concurrent SMTP connections and messages per second of broadcasts
+EMAIL_BROADCAST_CONNECTIONS = 4
+EMAIL_BROADCAST_RATE = 50
+# admin notifications are sent as a digest once the oldest is this many
+# seconds old, or once this many are buffered
+ADMIN_DIGEST_INTERVAL = 10 * 60
+ADMIN_DIGEST_MAX_COUNT = 50
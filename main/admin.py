@@ -75,6 +75,23 @@ class WorkshopAdmin(admin.ModelAdmin):
     ordering = ["-id"]
 
 
+@admin.register(models.BroadcastJob)
+class BroadcastJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "subject",
+        "dry_run",
+        "created_at",
+        "fanned_out_at",
+        "finished_at",
+        "failed_at",
+        "attempts",
+        "total",
+    )
+
+    ordering = ["-id"]
+
+
 @admin.register(models.EmailRecord)
 class EmailRecordAdmin(admin.ModelAdmin):
     list_display = (
@@ -82,6 +99,36 @@ class EmailRecordAdmin(admin.ModelAdmin):
         "email",
         "subscription",
         "subject",
+        "sent_at",
+        "failed_at",
+    )
+    list_filter = ("job",)
+
+    ordering = ["-id"]
+
+
+@admin.register(models.OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "subject",
+        "to",
+        "created_at",
+        "attempts",
+        "send_after",
+        "sent_at",
+    )
+
+    ordering = ["-id"]
+
+
+@admin.register(models.AdminNotification)
+class AdminNotificationAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "subject",
+        "workshop",
+        "created_at",
     )
 
     ordering = ["-id"]
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class MainConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "main"
+
+    def ready(self):
+        # connect the signal receivers invalidating cached pages and
+        # updating feeds
+        from main import caching, feeds  # noqa: F401
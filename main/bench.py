@@ -0,0 +1,33 @@
+import statistics
+
+from django.core.management.base import CommandError
+
+from main import models, outbox
+
+
+def percentile(timings, pct):
+    """Return the pct-th percentile of timings, interpolated between samples."""
+    if len(timings) < 2:
+        return timings[0]
+    return statistics.quantiles(timings, n=100, method="inclusive")[pct - 1]
+
+
+def check_database():
+    """Raise CommandError unless the database is a copy safe to benchmark.
+
+    Benchmarks queue emails and broadcasts go to every subscription, none
+    of them may reach real people.
+    """
+    pending = models.OutboxEmail.objects.filter(
+        sent_at__isnull=True, attempts__lt=outbox.MAX_ATTEMPTS
+    )
+    if pending.exists() or models.AdminNotification.objects.exists():
+        raise CommandError(
+            "Queued emails would be sent, "
+            "run against a copy of the database without them."
+        )
+    if models.Subscription.objects.exists():
+        raise CommandError(
+            "Broadcasts would be sent to existing subscribers, "
+            "run against a copy of the database without them."
+        )
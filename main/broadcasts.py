@@ -0,0 +1,219 @@
+import smtplib
+from email.message import MIMEPart
+
+from django.conf import settings
+from django.core import mail
+from django.db import transaction
+from django.utils import timezone
+
+from main import mailpool, models, outbox, utils
+
+# recipients loaded, recorded and sent at a time
+FAN_OUT_CHUNK_SIZE = 500
+# failed jobs are kept, but not retried, after this many attempts
+MAX_ATTEMPTS = 10
+
+
+class SendError(Exception):
+    pass
+
+
+def enqueue_broadcast(subject, body, workshop, dry_run):
+    """Queue a broadcast for run_mail_worker and return its job.
+
+    The ICS of workshop, if not None, is attached to every message.
+    """
+    return models.BroadcastJob.objects.create(
+        subject=subject,
+        body=body,
+        workshop=workshop,
+        dry_run=dry_run,
+    )
+
+
+def get_connection():
+    return mail.get_connection(
+        "django.core.mail.backends.smtp.EmailBackend",
+        # a different host than transactional emails
+        host=settings.EMAIL_HOST_BROADCASTS,
+    )
+
+
+def get_connection_pool():
+    return mailpool.ConnectionPool(
+        get_connection,
+        size=settings.EMAIL_BROADCAST_CONNECTIONS,
+        rate=settings.EMAIL_BROADCAST_RATE,
+    )
+
+
+def get_recipient_chunks(job):
+    """Yield the subscriptions a job has not created records for yet, by chunk.
+
+    Each chunk is loaded from the job's fan_out_cursor, which create_records
+    moves past it, and no cursor stays open while a chunk is sent.
+    """
+    # if dry run, override and sent only to broadcast preview email
+    if job.dry_run:
+        yield [models.Subscription(email=settings.EMAIL_BROADCAST_PREVIEW)]
+        return
+    subscriptions = models.Subscription.objects.order_by("id")
+    while chunk := list(
+        subscriptions.filter(id__gt=job.fan_out_cursor)[:FAN_OUT_CHUNK_SIZE]
+    ):
+        yield chunk
+
+
+def create_records(job, subscriptions):
+    """Create the unsent EmailRecords of a chunk of recipients."""
+    records = []
+    for subscription in subscriptions:
+        unsubscribe_url = utils.get_protocol() + subscription.get_unsubscribe_url()
+        records.append(
+            models.EmailRecord(
+                job=job,
+                # the preview subscription of a dry run is never saved
+                subscription=None if job.dry_run else subscription,
+                email=subscription.email,
+                subject=job.subject,
+                body=job.body + utils.get_email_body_footer(unsubscribe_url),
+                unsubscribe_url=unsubscribe_url,
+                sent_at=None,
+            )
+        )
+    with transaction.atomic():
+        models.EmailRecord.objects.bulk_create(records)
+        job.total += len(records)
+        job.fan_out_cursor = subscriptions[-1].id or 0
+        job.save(update_fields=["total", "fan_out_cursor"])
+    return records
+
+
+class BroadcastTemplate:
+    """The parts of a job's messages that are the same for every recipient.
+
+    The ICS attachment is generated and MIME encoded once per job, messages
+    share it and only add their recipient, unsubscribe footer and
+    List-Unsubscribe header.
+    """
+
+    def __init__(self, job):
+        self.subject = job.subject
+        self.headers = {
+            "X-PM-Message-Stream": settings.EMAIL_POSTMARK_HEADER,
+            "List-Unsubscribe-Post": "List-Unsubscribe=One-Click",
+        }
+        self.attachments = []
+        # a deleted workshop leaves the job without an attachment
+        if job.workshop:
+            filename, content, mimetype = utils.get_ics_attachment(job.workshop)
+            maintype, subtype = mimetype.split("/")
+            part = MIMEPart()
+            part.set_content(
+                content.encode(), maintype=maintype, subtype=subtype, filename=filename
+            )
+            self.attachments.append(part)
+
+    def build_message(self, record):
+        return mail.EmailMessage(
+            subject=self.subject,
+            # body with the recipient's footer, from create_records
+            body=record.body,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[record.email],
+            reply_to=[settings.DEFAULT_FROM_EMAIL],
+            headers={**self.headers, "List-Unsubscribe": record.unsubscribe_url},
+            attachments=self.attachments,
+        )
+
+
+def is_rejection(error):
+    """Whether the SMTP server rejected a message for good, not the connection."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return (
+        isinstance(error, smtplib.SMTPResponseException)
+        # the sender is the same for every message, retry the job
+        and not isinstance(error, smtplib.SMTPSenderRefused)
+        and error.smtp_code >= 500
+    )
+
+
+def send_records(records, pool, template):
+    """Send a chunk of records and mark the ones sent or rejected.
+
+    Records the SMTP server rejects are marked failed and not sent again.
+    Raise SendError if others could not be sent, after marking the rest.
+    """
+    messages = [template.build_message(record) for record in records]
+    sent, errors = pool.send(messages)
+    now = timezone.now()
+    models.EmailRecord.objects.filter(
+        id__in=[records[index].id for index in sent]
+    ).update(sent_at=now)
+
+    rejected = []
+    for index, error in errors.items():
+        if is_rejection(error):
+            records[index].failed_at = now
+            records[index].error = str(error)
+            rejected.append(records[index])
+    models.EmailRecord.objects.bulk_update(rejected, ["failed_at", "error"])
+    if len(rejected) < len(errors):
+        index, error = next(
+            (index, error) for index, error in errors.items() if not is_rejection(error)
+        )
+        raise SendError(
+            f"{len(errors) - len(rejected)} of {len(records)} emails not sent, "
+            f"{records[index].email}: {error}"
+        )
+
+
+def get_next_job():
+    """Return the next unfinished job that is due, failed jobs wait their turn."""
+    return (
+        models.BroadcastJob.objects.filter(
+            finished_at__isnull=True,
+            failed_at__isnull=True,
+            send_after__lte=timezone.now(),
+        )
+        .order_by("send_after", "id")
+        .first()
+    )
+
+
+def mark_failed(job, error):
+    """Retry a job later, with the backoff of the outbox, or give up on it."""
+    job.attempts += 1
+    job.last_error = str(error)
+    job.send_after = timezone.now() + outbox.get_retry_delay(job.attempts)
+    if job.attempts >= MAX_ATTEMPTS:
+        job.failed_at = timezone.now()
+    job.save(update_fields=["attempts", "last_error", "send_after", "failed_at"])
+
+
+def process_job(job):
+    """Send a job, one chunk of recipients at a time.
+
+    Records are created and marked sent per chunk, so memory use does not
+    grow with the number of subscribers. Records of a chunk interrupted by
+    a crash are sent first on resume, a hard crash may send the messages
+    of that chunk twice.
+    """
+    template = BroadcastTemplate(job)
+    with get_connection_pool() as pool:
+        # sent records drop out of the query, chunk after chunk
+        unsent = job.records.filter(
+            sent_at__isnull=True, failed_at__isnull=True
+        ).order_by("id")
+        while chunk := list(unsent[:FAN_OUT_CHUNK_SIZE]):
+            send_records(chunk, pool, template)
+
+        if not job.fanned_out_at:
+            for chunk in get_recipient_chunks(job):
+                send_records(create_records(job, chunk), pool, template)
+            job.fanned_out_at = timezone.now()
+            job.save(update_fields=["fanned_out_at"])
+
+    job.finished_at = timezone.now()
+    job.save(update_fields=["finished_at"])
@@ -0,0 +1,282 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import caches
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Count, F, Max
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from django.views.decorators.http import condition
+
+from main import models
+
+PAGE_CACHE_PREFIX = "page-cache"
+PAGE_CACHE_COUNTERS = ["hits", "misses"]
+
+
+def get_cache():
+    return caches[settings.PAGE_CACHE_ALIAS]
+
+
+def get_version_key(model):
+    return f"{PAGE_CACHE_PREFIX}:version:{model._meta.label_lower}"
+
+
+def get_versions(page_models):
+    """Return the current version token of each model a page depends on."""
+    cache = get_cache()
+    keys = [get_version_key(model) for model in page_models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # a fresh random token, so that pages cached under a version
+            # that was evicted can never be served again
+            cache.add(key, uuid.uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(model):
+    get_cache().set(get_version_key(model), uuid.uuid4().hex, None)
+
+
+# hits and misses of this process not written to the database yet
+_pending = Counter()
+_pending_lock = threading.Lock()
+_flushed_at = time.monotonic()
+
+
+def record(counter):
+    """Count a hit or miss, written every PAGE_CACHE_STATS_INTERVAL seconds."""
+    global _flushed_at
+    with _pending_lock:
+        _pending[counter] += 1
+        if time.monotonic() - _flushed_at < settings.PAGE_CACHE_STATS_INTERVAL:
+            return
+        counts = dict(_pending)
+        _pending.clear()
+        _flushed_at = time.monotonic()
+    try:
+        flush_stats(counts)
+    except DatabaseError:
+        # such as a locked database, counted again with the next write
+        with _pending_lock:
+            _pending.update(counts)
+
+
+def flush_stats(counts):
+    """Add counts to the counters in the database, every process adds its own."""
+    with transaction.atomic():
+        models.PageCacheCounter.objects.bulk_create(
+            [models.PageCacheCounter(name=name) for name in counts],
+            ignore_conflicts=True,
+        )
+        for name, count in counts.items():
+            models.PageCacheCounter.objects.filter(name=name).update(
+                value=F("value") + count
+            )
+
+
+def get_stats():
+    """Return the counters, with the counts of this process not written yet."""
+    stats = dict.fromkeys(PAGE_CACHE_COUNTERS, 0)
+    stats.update(models.PageCacheCounter.objects.values_list("name", "value"))
+    with _pending_lock:
+        for name, count in _pending.items():
+            stats[name] += count
+    return stats
+
+
+def reset_stats():
+    global _flushed_at
+    with _pending_lock:
+        _pending.clear()
+        _flushed_at = time.monotonic()
+    models.PageCacheCounter.objects.update(value=0)
+
+
+def is_anonymous_request(request):
+    """Whether the page is the same for every visitor making this request."""
+    if request.user.is_authenticated:
+        return False
+    # pages show pending messages, such as "logged out", only once
+    return not len(messages.get_messages(request))
+
+
+def is_cacheable_request(request):
+    return request.method == "GET" and is_anonymous_request(request)
+
+
+def is_cacheable_response(request, response):
+    if response.streaming or response.status_code != 200 or response.cookies:
+        return False
+    # pages with a form include a CSRF token bound to the visitor's cookie
+    if request.META.get("CSRF_COOKIE_NEEDS_UPDATE"):
+        return False
+    # rows read inside a transaction may still be rolled back, in which case
+    # no signal would ever invalidate the page rendered from them
+    return not connection.in_atomic_block
+
+
+def get_page_key(request, page_models):
+    versions = get_versions(page_models)
+    # pages split workshops and posts into future and past by date
+    today = timezone.now().date().isoformat()
+    key = "|".join([request.get_full_path(), today, settings.DEPLOY_VERSION, *versions])
+    digest = hashlib.md5(key.encode("utf-8")).hexdigest()
+    return f"{PAGE_CACHE_PREFIX}:page:{digest}"
+
+
+def cache_anonymous_page(*page_models):
+    """Cache pages served to anonymous visitors until page_models change.
+
+    Cached pages are invalidated by the post_save and post_delete signals of
+    the models passed, which must be listed in PAGE_CACHE_MODELS.
+    """
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not is_cacheable_request(request):
+                return view_func(request, *args, **kwargs)
+
+            cache = get_cache()
+            key = get_page_key(request, page_models)
+            response = cache.get(key)
+            if response is not None:
+                record("hits")
+                response["X-Page-Cache"] = "hit"
+                return get_conditional_response(
+                    request,
+                    etag=response.get("ETag"),
+                    last_modified=parse_http_date_safe(
+                        response.get("Last-Modified", "")
+                    ),
+                    response=response,
+                )
+
+            record("misses")
+            response = view_func(request, *args, **kwargs)
+            response["X-Page-Cache"] = "miss"
+
+            def store(response):
+                if is_cacheable_response(request, response):
+                    cache.set(key, response, settings.PAGE_CACHE_TIMEOUT)
+
+            if hasattr(response, "render") and callable(response.render):
+                response.add_post_render_callback(store)
+            else:
+                store(response)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def get_deleted_key(model):
+    return f"{PAGE_CACHE_PREFIX}:deleted:{model._meta.label_lower}"
+
+
+def get_page_validators(request, page_models, lookup, related, kwargs):
+    """Return the ETag and last modification time of the rows a page shows."""
+    if hasattr(request, "_page_validators"):
+        return request._page_validators
+
+    # pages split workshops and posts into future and past by date, so
+    # they may change at midnight without any row changing
+    now = timezone.now()
+    last_modified = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    querysets = []
+    for model in page_models:
+        queryset = model.objects.all()
+        if lookup:
+            queryset = queryset.filter(**{lookup: kwargs[lookup]})
+        querysets.append(queryset)
+    for model, path in related.items():
+        querysets.append(model.objects.filter(**{path: kwargs[lookup]}))
+    # deleting a row does not change the latest updated_at of the others
+    deleted = get_cache().get_many(
+        [get_deleted_key(queryset.model) for queryset in querysets]
+    )
+    parts = [request.path, settings.DEPLOY_VERSION]
+    for queryset in querysets:
+        model = queryset.model
+        stats = queryset.aggregate(count=Count("pk"), updated_at=Max("updated_at"))
+        if model in page_models and lookup and not stats["count"]:
+            # let the view answer 404
+            request._page_validators = (None, None)
+            return request._page_validators
+        parts += [str(stats["count"]), str(stats["updated_at"])]
+        for timestamp in [stats["updated_at"], deleted.get(get_deleted_key(model))]:
+            if timestamp and timestamp > last_modified:
+                last_modified = timestamp
+
+    parts.append(last_modified.isoformat())
+    etag = hashlib.md5("|".join(parts).encode("utf-8")).hexdigest()
+    request._page_validators = (f'"{etag}"', last_modified)
+    return request._page_validators
+
+
+def conditional_page(*page_models, lookup=None, related=None):
+    """Answer revalidations of anonymous visitors with 304 Not Modified.
+
+    Validators are computed from the count and latest updated_at of the
+    rows of page_models, filtered on the `lookup` URL keyword if given.
+    `related` maps other models the page shows to the path from them to
+    that keyword, such as {models.User: "post__slug"} for a post's author.
+    """
+    related = related or {}
+
+    def etag_func(request, *args, **kwargs):
+        return get_page_validators(request, page_models, lookup, related, kwargs)[0]
+
+    def last_modified_func(request, *args, **kwargs):
+        return get_page_validators(request, page_models, lookup, related, kwargs)[1]
+
+    def decorator(view_func):
+        conditional_view = condition(etag_func, last_modified_func)(view_func)
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method in ("GET", "HEAD") and is_anonymous_request(request):
+                return conditional_view(request, *args, **kwargs)
+            return view_func(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# models whose changes invalidate cached pages
+PAGE_CACHE_MODELS = [
+    models.Post,
+    models.Workshop,
+    models.Mentorship,
+    models.Incident,
+    models.User,
+]
+
+
+def invalidate_pages(sender, signal, **kwargs):
+    if kwargs.get("update_fields") == frozenset(["last_login"]):
+        # every login saves the user, but pages do not show it
+        return
+    if signal is post_delete:
+        get_cache().set(get_deleted_key(sender), timezone.now(), None)
+    bump_version(sender)
+    # pages rendered before the transaction commits show the old rows
+    transaction.on_commit(lambda: bump_version(sender))
+
+
+for model in PAGE_CACHE_MODELS:
+    post_save.connect(invalidate_pages, sender=model)
+    post_delete.connect(invalidate_pages, sender=model)
@@ -0,0 +1,189 @@
+import hashlib
+import os
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.http import HttpResponse
+from django.template.loader import get_template, render_to_string
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from main import models
+
+EVENTS_ICS = "events.ics"
+# default window of events.ics around now, the archive is not listed
+EVENTS_PAST = timedelta(days=365)
+EVENTS_FUTURE = timedelta(days=365)
+# workshops fetched at a time when streaming events.ics
+EVENTS_CHUNK_SIZE = 100
+# stored feeds are rendered again after this long, for windows relative to now
+FEED_MAX_AGE = timedelta(days=1)
+# suffix of the file next to a feed file holding its ETag, which Caddy's
+# file_server reads instead of making one up from the file's size and time
+ETAG_FILE_SUFFIX = ".etag"
+
+
+def get_events_window(since=None, until=None):
+    """Return the window of events.ics, defaults filling in missing bounds."""
+    now = timezone.now()
+    if until is None:
+        until = now + EVENTS_FUTURE
+    if since is None:
+        since = min(until, now) - EVENTS_PAST
+    return since, until
+
+
+def iter_events_ics(since, until):
+    """Yield events.ics for the workshops scheduled in a window, an event at a time.
+
+    Rows are loaded a chunk at a time by key, the memory used does not grow
+    with the number of workshops and no cursor stays open while events are
+    written to a slow client.
+    """
+    yield render_to_string("main/workshop_list_ics_header.html")
+    event_template = get_template("main/workshop_list_ics_event.html")
+    workshop_list = (
+        models.Workshop.objects.filter(
+            is_confirmed=True,
+            scheduled_at__gte=since,
+            scheduled_at__lt=until,
+        )
+        .only("title", "body", "scheduled_at", "location_name")
+        .order_by("pk")
+    )
+    last = 0
+    while chunk := list(workshop_list.filter(pk__gt=last)[:EVENTS_CHUNK_SIZE]):
+        for workshop in chunk:
+            yield event_template.render({"w": workshop})
+        last = chunk[-1].pk
+    yield "END:VCALENDAR\n"
+
+
+def render_events_ics():
+    """Render events.ics for the default window."""
+    return "".join(iter_events_ics(*get_events_window())).encode()
+
+
+# feed name to the function rendering its content
+FEED_RENDERERS = {EVENTS_ICS: render_events_ics}
+
+
+def get_etag(feed):
+    return f'"{feed.sha256}"'
+
+
+def get_last_modified(feed):
+    return int(feed.updated_at.timestamp())
+
+
+def replace_file(path, content, mtime):
+    """Replace a file in FEEDS_ROOT, never leaving it half written."""
+    with tempfile.NamedTemporaryFile(dir=settings.FEEDS_ROOT, delete=False) as f:
+        f.write(content)
+    # readable by Caddy, which serves the modification time as Last-Modified
+    os.chmod(f.name, 0o644)
+    os.utime(f.name, (mtime, mtime))
+    os.replace(f.name, path)
+
+
+def write_feed_file(feed):
+    """Write the file of a feed and its ETag, the validators of serve_feed."""
+    os.makedirs(settings.FEEDS_ROOT, exist_ok=True)
+    path = os.path.join(settings.FEEDS_ROOT, feed.name)
+    mtime = get_last_modified(feed)
+    replace_file(path, bytes(feed.content), mtime)
+    # after the content, the old content is never served with the new ETag
+    replace_file(path + ETAG_FILE_SUFFIX, get_etag(feed).encode(), mtime)
+
+
+def update_feed(name):
+    """Render a feed and store it if its content changed, return the feed."""
+    # cleared first, a change while rendering marks it stale again
+    models.Feed.objects.filter(name=name).update(stale=False)
+    # rendered outside of the transaction, which holds the write lock
+    content = FEED_RENDERERS[name]()
+    sha256 = hashlib.sha256(content).hexdigest()
+    with transaction.atomic():
+        feed = models.Feed.objects.filter(name=name).first()
+        if feed is not None and feed.sha256 == sha256:
+            feed.rendered_at = timezone.now()
+            feed.save(update_fields=["rendered_at"])
+            return feed
+
+        feed, _ = models.Feed.objects.update_or_create(
+            name=name,
+            defaults={
+                "content": content,
+                "sha256": sha256,
+                "updated_at": timezone.now(),
+                "rendered_at": timezone.now(),
+            },
+        )
+        if settings.FEEDS_WRITE_FILES:
+            transaction.on_commit(lambda: write_feed_file(feed))
+    return feed
+
+
+def update_stale_feeds():
+    """Render the stale feeds and the old ones, return their names.
+
+    Run by run_feed_worker, so that requests never render a feed.
+    """
+    names = list(
+        models.Feed.objects.filter(
+            Q(stale=True) | Q(rendered_at__lt=timezone.now() - FEED_MAX_AGE)
+        ).values_list("name", flat=True)
+    )
+    for name in names:
+        update_feed(name)
+    return names
+
+
+def get_feed(name):
+    """Return a feed, rendered first only if it does not exist yet.
+
+    A stale feed is served until run_feed_worker renders it again.
+    """
+    feed = models.Feed.objects.filter(name=name).first()
+    if feed is None:
+        feed = update_feed(name)
+    return feed
+
+
+def mark_stale(name):
+    """Have a feed rendered again by run_feed_worker.
+
+    The flag is rolled back with the transaction. Changing many rows at
+    once renders the feed once.
+    """
+    models.Feed.objects.filter(name=name).update(stale=True)
+
+
+def serve_feed(request, feed, content_type):
+    """Return a response with the content of a feed, or 304 Not Modified."""
+    etag = get_etag(feed)
+    last_modified = get_last_modified(feed)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = HttpResponse(bytes(feed.content), content_type=content_type)
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    # calendar clients poll, revalidating is a 304 without a body
+    patch_cache_control(response, public=True, no_cache=True)
+    return response
+
+
+def update_workshop_feeds(sender, **kwargs):
+    if kwargs.get("raw"):
+        # loaddata, the rows it saves may not be consistent yet
+        return
+    mark_stale(EVENTS_ICS)
+
+
+post_save.connect(update_workshop_feeds, sender=models.Workshop)
+post_delete.connect(update_workshop_feeds, sender=models.Workshop)
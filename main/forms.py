@@ -37,15 +37,10 @@ class BroadcastForm(forms.Form):
     dry_run = forms.BooleanField(
         required=False, help_text="Send email only to preview users for testing."
     )
-
-    def get_workshops_as_choices():
-        workshops = [("no-ics", "NO ICS")]
-        for workshop in models.Workshop.objects.filter(scheduled_at__isnull=False):
-            workshops.append((workshop.slug, workshop.title))
-        return workshops
-
-    ics_attachment = forms.ChoiceField(
-        choices=get_workshops_as_choices,
+    ics_attachment = forms.ModelChoiceField(
+        queryset=models.Workshop.objects.filter(scheduled_at__isnull=False),
+        required=False,
+        empty_label="NO ICS",
         label="Include ICS attachment",
     )
 
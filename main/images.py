@@ -0,0 +1,248 @@
+import hashlib
+import io
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.db import connection
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+# directory of image files inside MEDIA_ROOT
+IMAGES_DIR = "images"
+# slugs are random and never reused, so a year is as good as forever
+IMAGE_MAX_AGE = 60 * 60 * 24 * 365
+RANGE_CHUNK_SIZE = 64 * 1024
+
+
+# an image file stored outside of the Image model, such as an avatar
+StoredFile = namedtuple("StoredFile", ["path", "sha256", "size", "extension"])
+
+
+def get_content_path(sha256, extension):
+    """Return the storage path of an image file named after its content hash."""
+    return f"{IMAGES_DIR}/{sha256[:2]}/{sha256}.{extension}"
+
+
+def store_image_file(f, sha256, extension):
+    """Write an image file to its content-addressed path, unless present.
+
+    Return the storage path.
+    """
+    path = get_content_path(sha256, extension)
+    if not default_storage.exists(path):
+        path = default_storage.save(path, f)
+    return path
+
+
+def store_image_data(data, extension):
+    """Write image bytes to their content-addressed file, unless present.
+
+    Return the sha256 hex digest of the data and the storage path.
+    """
+    sha256 = hashlib.sha256(data).hexdigest()
+    return sha256, store_image_file(ContentFile(data), sha256, extension)
+
+
+def hash_uploaded_file(f):
+    """Return the sha256 hex digest of an uploaded file, read in chunks."""
+    digest = hashlib.sha256()
+    for chunk in f.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadSizeLimitHandler(FileUploadHandler):
+    """Stop receiving a file of an upload as soon as it is too big.
+
+    The names of rejected files are listed in request.rejected_uploads. The
+    rest of a rejected file is read and discarded, never buffered, and the
+    fields after it, such as the CSRF token, are still received.
+    """
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.IMAGE_UPLOAD_MAX_SIZE:
+            if not hasattr(self.request, "rejected_uploads"):
+                self.request.rejected_uploads = []
+            self.request.rejected_uploads.append(self.file_name)
+            raise SkipFile()
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+def read_image_data(image):
+    if not image.path:
+        return bytes(image.data)
+    with default_storage.open(image.path, "rb") as f:
+        return f.read()
+
+
+def get_content_type(image):
+    return "image/" + image.extension
+
+
+def get_etag(image):
+    """Return a strong ETag, images never change once uploaded."""
+    if not image.sha256:
+        return None
+    return f'"{image.sha256}"'
+
+
+def parse_range(header, size):
+    """Return the (start, end) bytes of a single-range Range header.
+
+    Return None if the header is absent, malformed or asks for several
+    ranges, in which case the whole image is served. Raise ValueError if
+    the range is not satisfiable.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, sep, end = header[len("bytes=") :].strip().partition("-")
+    if not sep or not (start + end).isdigit():
+        return None
+    if not start:
+        # suffix range: the last `end` bytes
+        if not int(end):
+            raise ValueError("empty suffix range")
+        return max(0, size - int(end)), size - 1
+    start = int(start)
+    end = int(end) if end else size - 1
+    if start >= size or end < start:
+        raise ValueError("range outside of image")
+    return start, min(end, size - 1)
+
+
+class FileRange:
+    """Iterate over `length` bytes of a file-like object from `start`.
+
+    The file is closed with the response, even if it is never iterated.
+    """
+
+    def __init__(self, f, start, length, chunk_size=RANGE_CHUNK_SIZE):
+        self.f = f
+        self.start = start
+        self.length = length
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        self.f.seek(self.start)
+        remaining = self.length
+        while remaining > 0:
+            chunk = self.f.read(min(self.chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    def close(self):
+        self.f.close()
+
+
+class ImageBlob:
+    """A read-only file of the bytes of an image stored in SQLite.
+
+    Reads go through SQLite's incremental blob I/O, so the bytes are never
+    loaded at once. The blob is opened for each read and closed again, an
+    open blob holds a read lock that would block writers for as long as a
+    slow client takes to download the image.
+    """
+
+    def __init__(self, image):
+        self.table = image._meta.db_table
+        self.pk = image.pk
+        self.position = 0
+        with self.open() as blob:
+            self.size = len(blob)
+
+    def open(self):
+        connection.ensure_connection()
+        return connection.connection.blobopen(
+            self.table, "data", self.pk, readonly=True
+        )
+
+    def __len__(self):
+        return self.size
+
+    def seek(self, offset):
+        self.position = offset
+
+    def read(self, size):
+        with self.open() as blob:
+            blob.seek(self.position)
+            chunk = blob.read(size)
+        self.position += len(chunk)
+        return chunk
+
+    def close(self):
+        pass
+
+
+def serve_image(request, image, immutable=True):
+    """Return a response with the bytes of an image, wherever they are stored.
+
+    Image slugs are random and never reused, so responses are cacheable
+    forever, revalidated with the content hash and may be partial. URLs
+    whose content can change pass immutable=False to be revalidated.
+    """
+    etag = get_etag(image)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = get_image_response(request, image, etag)
+    if etag:
+        response["ETag"] = etag
+    if response.status_code >= 400:
+        # an unsatisfiable range, not the image
+        return response
+    if immutable:
+        patch_cache_control(
+            response, public=True, max_age=IMAGE_MAX_AGE, immutable=True
+        )
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
+    return response
+
+
+def get_image_response(request, image, etag):
+    content_type = get_content_type(image)
+    if image.path and settings.IMAGES_ACCEL_REDIRECT:
+        # Caddy intercepts the header and serves the file itself, ranges too
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = "/" + image.path
+        return response
+
+    if image.path:
+        f = default_storage.open(image.path, "rb")
+        size = image.size
+    elif connection.vendor == "sqlite":
+        f = ImageBlob(image)
+        size = len(f)
+    else:
+        f = io.BytesIO(bytes(image.data))
+        size = len(f.getbuffer())
+
+    byte_range = None
+    if_range = request.headers.get("If-Range")
+    if not if_range or (etag and if_range == etag):
+        try:
+            byte_range = parse_range(request.headers.get("Range"), size)
+        except ValueError:
+            f.close()
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    start, end = byte_range or (0, size - 1)
+    length = end - start + 1
+    response = StreamingHttpResponse(
+        FileRange(f, start, length), content_type=content_type
+    )
+    response["Content-Length"] = str(length)
+    response["Accept-Ranges"] = "bytes"
+    if byte_range:
+        response.status_code = 206
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return response
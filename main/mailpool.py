@@ -0,0 +1,135 @@
+import queue
+import threading
+import time
+
+
+class RateLimiter:
+    """Space calls to acquire() out to at most `rate` per second.
+
+    Shared by threads, a rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_at = time.monotonic()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Delivery:
+    def __init__(self, index, message):
+        self.index = index
+        self.message = message
+        self.attempts = 0
+        # workers whose connection failed to send the message
+        self.failed_on = set()
+        self.error = None
+
+
+class ConnectionPool:
+    """Send messages over `size` concurrent connections of the same backend.
+
+    A message whose send fails is retried on another connection, up to
+    `retries` times. Use as a context manager, connections are opened
+    lazily and stay open between calls to send().
+    """
+
+    def __init__(self, get_connection, size, rate=0, retries=2):
+        self.get_connection = get_connection
+        self.size = size
+        self.rate_limiter = RateLimiter(rate)
+        self.retries = retries
+        self.connections = [None] * size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        for connection in self.connections:
+            if connection is not None:
+                connection.close()
+        self.connections = [None] * self.size
+
+    def get_worker_connection(self, worker):
+        if self.connections[worker] is None:
+            self.connections[worker] = self.get_connection()
+            self.connections[worker].open()
+        return self.connections[worker]
+
+    def reset_worker_connection(self, worker):
+        connection = self.connections[worker]
+        self.connections[worker] = None
+        try:
+            connection.close()
+        except Exception:
+            # the connection is broken already
+            pass
+
+    def send(self, messages):
+        """Send messages and return the indexes of the sent ones and errors.
+
+        Errors are a dict of the index of each message that could not be
+        sent to the last exception raised sending it.
+        """
+        deliveries = queue.Queue()
+        for index, message in enumerate(messages):
+            deliveries.put(Delivery(index, message))
+        sent = []
+        errors = {}
+        lock = threading.Lock()
+        worker_count = min(self.size, len(messages))
+
+        def work(worker):
+            while (delivery := deliveries.get()) is not None:
+                try:
+                    if (
+                        worker in delivery.failed_on
+                        and len(delivery.failed_on) < worker_count
+                    ):
+                        # leave it to a connection that has not failed it
+                        deliveries.put(delivery)
+                        time.sleep(0.01)
+                        continue
+                    self.deliver(worker, delivery)
+                    with lock:
+                        if delivery.error is None:
+                            sent.append(delivery.index)
+                        elif delivery.attempts > self.retries:
+                            errors[delivery.index] = delivery.error
+                        else:
+                            deliveries.put(delivery)
+                finally:
+                    deliveries.task_done()
+
+        workers = [
+            threading.Thread(target=work, args=(worker,))
+            for worker in range(worker_count)
+        ]
+        for thread in workers:
+            thread.start()
+        deliveries.join()
+        for _ in workers:
+            deliveries.put(None)
+        for thread in workers:
+            thread.join()
+        return sorted(sent), errors
+
+    def deliver(self, worker, delivery):
+        self.rate_limiter.acquire()
+        delivery.attempts += 1
+        try:
+            self.get_worker_connection(worker).send_messages([delivery.message])
+            delivery.error = None
+        except Exception as exc:
+            delivery.failed_on.add(worker)
+            delivery.error = exc
+            self.reset_worker_connection(worker)
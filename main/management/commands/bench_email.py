@@ -0,0 +1,181 @@
+import time
+import tracemalloc
+import uuid
+
+from django.core.mail.backends import smtp
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from main import bench, broadcasts, models, notifications, outbox, smtpsink
+
+
+class Command(BaseCommand):
+    help = "Benchmark sending broadcasts and RSVP emails to a local SMTP sink"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--subscribers",
+            type=int,
+            default=1000,
+            help="Number of subscriptions seeded for the broadcast.",
+        )
+        parser.add_argument(
+            "--rsvps",
+            type=int,
+            default=100,
+            help="Number of RSVPs posted to the workshop page.",
+        )
+        parser.add_argument(
+            "--connections",
+            type=int,
+            default=None,
+            help="Broadcast connections, EMAIL_BROADCAST_CONNECTIONS by default.",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=0,
+            help="Broadcast messages per second, 0 (default) for no limit.",
+        )
+        parser.add_argument(
+            "--delay",
+            type=float,
+            default=0,
+            help="Milliseconds the sink waits before accepting each message.",
+        )
+
+    def handle(self, *args, **options):
+        bench.check_database()
+
+        tag = uuid.uuid4().hex[:8]
+        with smtpsink.SMTPSink(delay=options["delay"] / 1000) as sink:
+            email_settings = {
+                "EMAIL_BACKEND": "django.core.mail.backends.smtp.EmailBackend",
+                "EMAIL_HOST": "127.0.0.1",
+                "EMAIL_HOST_BROADCASTS": "127.0.0.1",
+                "EMAIL_PORT": sink.port,
+                "EMAIL_USE_TLS": False,
+                "EMAIL_USE_SSL": False,
+                "EMAIL_HOST_USER": "",
+                "EMAIL_HOST_PASSWORD": "",
+                "EMAIL_BROADCAST_RATE": options["rate"],
+            }
+            if options["connections"]:
+                email_settings["EMAIL_BROADCAST_CONNECTIONS"] = options["connections"]
+
+            models.Subscription.objects.bulk_create(
+                models.Subscription(email=f"bench-{tag}-{i}@example.com")
+                for i in range(options["subscribers"])
+            )
+            workshop = models.Workshop.objects.create(
+                title="Benchmark",
+                slug=f"bench-{tag}",
+                body="A workshop to benchmark emails.",
+                scheduled_at=timezone.now(),
+                location_name="Newspeak House",
+                location_address="E2",
+                location_url="https://chaitinschool.org/",
+            )
+            jobs = []
+            try:
+                with override_settings(**email_settings):
+                    self.run(
+                        "broadcast",
+                        lambda run: jobs.append(self.send_broadcast(workshop)),
+                        sink,
+                    )
+                    self.run(
+                        "rsvp",
+                        lambda run: self.send_rsvps(
+                            workshop, options["rsvps"], f"{tag}-{run}"
+                        ),
+                        sink,
+                    )
+            finally:
+                for job in jobs:
+                    job.records.all().delete()
+                    job.delete()
+                workshop.delete()
+                # RSVP emails link to the workshop or name the attendee
+                models.OutboxEmail.objects.filter(
+                    body__contains=f"bench-{tag}"
+                ).delete()
+                models.Subscription.objects.filter(
+                    email__startswith=f"bench-{tag}-"
+                ).delete()
+
+    def send_broadcast(self, workshop):
+        """Queue a broadcast like the Broadcast view and send it like the worker."""
+        job = broadcasts.enqueue_broadcast(
+            subject="Benchmark",
+            body="Hey! We're having a workshop :D\n" * 20,
+            workshop=workshop,
+            dry_run=False,
+        )
+        broadcasts.process_job(job)
+        return job
+
+    def send_rsvps(self, workshop, count, tag):
+        """Post RSVPs to the workshop page, then send them and the admin digest."""
+        client = Client(SERVER_NAME="localhost")
+        url = reverse("workshop", args=(workshop.slug,))
+        for i in range(count):
+            client.post(url, {"email": f"bench-{tag}-{i}@example.com"})
+        notifications.flush_digests()
+        while any(outbox.send_due()):
+            pass
+
+    def run(self, name, send, sink):
+        """Run send twice, timed then traced, and report the timed run.
+
+        Per-message latency is the time each SMTP backend takes to send a
+        message, whichever code path and thread sends it.
+        """
+        timings = []
+        queries = []
+
+        def count_query(execute, sql, params, many, context):
+            # the query log is reset at the start of each request
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        send_message = smtp.EmailBackend._send
+
+        def timed_send(backend, message):
+            start = time.perf_counter()
+            try:
+                return send_message(backend, message)
+            finally:
+                timings.append((time.perf_counter() - start) * 1000)
+
+        smtp.EmailBackend._send = timed_send
+        try:
+            messages_before = sink.messages
+            start = time.perf_counter()
+            with connection.execute_wrapper(count_query):
+                send(0)
+            elapsed = time.perf_counter() - start
+            sent = sink.messages - messages_before
+        finally:
+            smtp.EmailBackend._send = send_message
+
+        tracemalloc.start()
+        send(1)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        if not sent:
+            self.stderr.write(f"{name}: no messages sent")
+            return
+        timings.sort()
+        self.stdout.write(
+            f"{name:<10} {sent} messages in {elapsed:.2f}s"
+            f" {sent / elapsed:.0f} msg/s"
+            f" p50={bench.percentile(timings, 50):.2f}ms"
+            f" p99={bench.percentile(timings, 99):.2f}ms"
+            f" queries={len(queries)} ({len(queries) / sent:.2f}/msg)"
+            f" python peak={peak / 1e6:.1f}MB"
+        )
@@ -0,0 +1,114 @@
+import os
+import resource
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from main import bench, models, views
+
+
+def buffered_image_raw(request, slug, extension):
+    """image_raw as it was, loading the whole blob through the ORM."""
+    image = models.Image.objects.with_data().get(slug=slug)
+    return HttpResponse(image.data, content_type="image/" + image.extension)
+
+
+def fetch(view, slug):
+    request = RequestFactory().get(f"/images/{slug}.png")
+    request.user = AnonymousUser()
+    start = time.perf_counter()
+    try:
+        response = view(request, slug, "png")
+        if response.streaming:
+            size = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            size = len(response.content)
+        response.close()
+    finally:
+        # like the end of a request, each thread has its own connection
+        connections.close_all()
+    return (time.perf_counter() - start) * 1000, size
+
+
+class Command(BaseCommand):
+    help = "Benchmark memory and latency of serving images stored in SQLite"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            type=int,
+            default=1000,
+            help="Size of the image in KB.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=50,
+            help="Number of concurrent requests.",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=200,
+            help="Number of requests per mode.",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            self.stderr.write("Incremental blob I/O is only used with SQLite.")
+
+        data = os.urandom(options["size"] * 1000)
+        image = models.Image.objects.create(
+            name="bench",
+            slug="bench-" + uuid.uuid4().hex[:8],
+            extension="png",
+            data=data,
+            size=len(data),
+        )
+        try:
+            # streaming first, peak RSS only ever grows
+            for name, view in [
+                ("streaming", views.image_raw),
+                ("buffered", buffered_image_raw),
+            ]:
+                self.run(name, view, image.slug, len(data), options)
+        finally:
+            image.delete()
+
+    def run(self, name, view, slug, size, options):
+        def fetch_all():
+            with ThreadPoolExecutor(options["concurrency"]) as pool:
+                return list(
+                    pool.map(lambda _: fetch(view, slug), range(options["requests"]))
+                )
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        results = fetch_all()
+        elapsed = time.perf_counter() - start
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # a second run traced, tracing slows allocations down too much to
+        # measure latency at the same time
+        tracemalloc.start()
+        fetch_all()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        timings = sorted(timing for timing, _ in results)
+        if any(length != size for _, length in results):
+            self.stderr.write(f"{name}: incomplete responses")
+        self.stdout.write(
+            f"{name:<10} p50={bench.percentile(timings, 50):.1f}ms"
+            f" p99={bench.percentile(timings, 99):.1f}ms"
+            f" {len(timings) / elapsed:.0f} req/s"
+            f" python peak={peak / 1e6:.1f}MB"
+            f" max RSS +{(rss_after - rss_before) / 1000:.1f}MB"
+        )
@@ -0,0 +1,285 @@
+import json
+import statistics
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.apps import apps
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.core.paginator import Paginator
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
+from django.test import RequestFactory
+from django.utils import timezone
+
+from main import forms, models, render
+
+PARTIAL_TEMPLATES = ["partials/workshop_item.html"]
+
+
+def make_markdown(size):
+    """Return a markdown document of roughly `size` bytes."""
+    paragraph = (
+        "## Section\n\n"
+        "Some *emphasis*, some **strong** text, `inline code` and a "
+        "[link](https://chaitinschool.org/).\n\n"
+        "- [x] a finished task\n- [ ] an open task\n\n"
+        "```\ndef f(x):\n    return x\n```\n\n"
+        "A footnote[^1].\n\n"
+    )
+    body = paragraph * max(1, size // len(paragraph))
+    return body + "[^1]: The footnote.\n"
+
+
+def build_context(workshop_count, body_size):
+    """Return a context with unsaved objects usable by every template."""
+    now = timezone.now()
+    body = make_markdown(body_size)
+
+    user = models.User(id=1, username="alice", email="alice@example.com", plan=body)
+    post = models.Post(
+        id=1,
+        title="A post",
+        slug="a-post",
+        byline="About posts",
+        body=body,
+        published_at=now.date(),
+        author=user,
+    )
+    workshop = models.Workshop(
+        id=1,
+        title="A workshop",
+        slug="a-workshop",
+        body=body,
+        scheduled_at=now + timedelta(days=7),
+        location_name="Newspeak House",
+        location_address="133-135 Bethnal Green Road, E2 7DG",
+        location_url="https://newspeak.house/",
+        is_confirmed=True,
+    )
+    mentorship = models.Mentorship(
+        id=1,
+        mentor=user,
+        title="A mentorship",
+        slug="a-mentorship",
+        body=body,
+        is_available=True,
+    )
+    incident = models.Incident(
+        id=1, happened_at=now.date(), published_at=now, text=body
+    )
+    for obj in [user, post, workshop, mentorship, incident]:
+        obj.render_html_fields()
+
+    workshops = [
+        models.Workshop(
+            id=i,
+            title=f"Workshop {i}",
+            slug=f"workshop-{i}",
+            body="details",
+            scheduled_at=now + timedelta(days=i - workshop_count // 2),
+            is_confirmed=i % 10 != 0,
+        )
+        for i in range(1, workshop_count + 1)
+    ]
+    future_workshops = [w for w in workshops if w.scheduled_at >= now]
+    past_workshops = [w for w in workshops if w.scheduled_at < now]
+    posts = [
+        models.Post(
+            id=i,
+            title=f"Post {i}",
+            slug=f"post-{i}",
+            published_at=(now - timedelta(days=i)).date(),
+        )
+        for i in range(1, workshop_count // 10 + 2)
+    ]
+    images = [
+        models.Image(id=i, name=f"image-{i}", slug=f"img{i:05}", extension="png")
+        for i in range(1, workshop_count // 10 + 2)
+    ]
+
+    return {
+        "object": post,
+        "post": post,
+        "user": user,
+        "workshop": workshop,
+        "w": workshop,
+        "mentorship": mentorship,
+        "canonical_host": "chaitinschool.org",
+        "post_list": posts,
+        "draft_list": posts[:3],
+        "workshop_list": workshops,
+        "future_workshop_list": future_workshops,
+        "past_workshop_list": past_workshops,
+        "mentorship_list_available": [mentorship] * 20,
+        "mentorship_list_unavailable": [mentorship] * 20,
+        "incident_list": [incident] * 10,
+        "user_list": [user] * (workshop_count // 10 + 1),
+        "page_obj": Paginator(images, 50).get_page(1),
+        "subscriptions_list": [
+            models.Subscription(email=f"s{i}@example.com") for i in range(100)
+        ],
+        "subscriptions_count": 100,
+        "dry_run_email": "preview@example.com",
+        "form": forms.AnnounceForm(),
+        # templates rendering a specific object as `object`
+        "objects": {
+            "main/incident_detail.html": incident,
+            "main/mentorship_detail.html": mentorship,
+            "main/user_detail.html": user,
+            "main/user_confirm_delete.html": user,
+        },
+    }
+
+
+def time_call(iterations, func, *args):
+    """Return the median and minimum duration of func in milliseconds."""
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": statistics.median(timings), "min_ms": min(timings)}
+
+
+class Command(BaseCommand):
+    help = "Benchmark template and markdown rendering with synthetic data"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workshops",
+            type=int,
+            default=1000,
+            help="Number of workshops in list contexts.",
+        )
+        parser.add_argument(
+            "--body-size",
+            type=int,
+            default=100,
+            help="Size of markdown bodies in KB.",
+        )
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=5,
+            help="Number of renders timed per template.",
+        )
+        parser.add_argument(
+            "--output",
+            default="bench_render.json",
+            help="Path of the JSON results file.",
+        )
+        parser.add_argument(
+            "--baseline",
+            help="Path of a previous results file to compare against.",
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=20,
+            help="Slowdown percentage against the baseline counted as regression.",
+        )
+        parser.add_argument(
+            "--min-delta",
+            type=float,
+            default=1,
+            help="Slowdowns smaller than this many milliseconds are ignored.",
+        )
+
+    def get_template_names(self):
+        template_dir = Path(apps.get_app_config("main").path) / "templates"
+        names = sorted(
+            str(path.relative_to(template_dir))
+            for path in (template_dir / "main").glob("*.html")
+        )
+        return names + PARTIAL_TEMPLATES
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["baseline"]:
+            # read before the results are saved, which may overwrite it
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+
+        context = build_context(options["workshops"], options["body_size"] * 1000)
+        request = RequestFactory().get("/")
+        request.user = AnonymousUser()
+        iterations = options["iterations"]
+
+        results = {
+            "options": {
+                "workshops": options["workshops"],
+                "body_size": options["body_size"],
+                "iterations": iterations,
+            },
+            "templates": {},
+            "markdown": {},
+        }
+
+        for name in self.get_template_names():
+            template = get_template(name)
+            template_context = dict(context)
+            template_context["object"] = context["objects"].get(name, context["post"])
+            try:
+                template.render(template_context, request)
+            except TemplateDoesNotExist as exc:
+                # orphan templates, not served by any view
+                self.stdout.write(self.style.WARNING(f"{name} skipped: {exc}"))
+                continue
+            results["templates"][name] = time_call(
+                iterations, template.render, template_context, request
+            )
+
+        body = context["post"].body
+
+        def render_uncached():
+            render.markdown_cache.clear()
+            render.markdown_to_html(body)
+
+        def render_sanitized_uncached():
+            render.markdown_cache.clear()
+            render.sanitized_markdown_to_html(body)
+
+        results["markdown"] = {
+            "markdown_to_html": time_call(iterations, render_uncached),
+            "markdown_to_html (cached)": time_call(
+                iterations, render.markdown_to_html, body
+            ),
+            "sanitized_markdown_to_html": time_call(
+                iterations, render_sanitized_uncached
+            ),
+        }
+
+        for group in ["templates", "markdown"]:
+            for name, timing in results[group].items():
+                self.stdout.write(f"{name:<40} {timing['median_ms']:9.2f}ms")
+
+        with open(options["output"], "w") as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results saved at {options['output']}"))
+
+        if baseline is not None:
+            self.compare(results, baseline, options)
+
+    def compare(self, results, baseline, options):
+        regressions = []
+        for group in ["templates", "markdown"]:
+            for name, timing in results[group].items():
+                previous = baseline.get(group, {}).get(name)
+                if not previous:
+                    continue
+                # compare fastest runs, which are the least affected by noise
+                before = previous["min_ms"]
+                after = timing["min_ms"]
+                change = (after - before) / before * 100 if before else 0
+                self.stdout.write(
+                    f"{name:<40} {before:9.2f}ms -> {after:9.2f}ms ({change:+.0f}%)"
+                )
+                slower = after - before > options["min_delta"]
+                if slower and change > options["threshold"]:
+                    regressions.append(name)
+
+        if regressions:
+            raise CommandError(f"Render time regressed: {', '.join(regressions)}")
+        self.stdout.write(self.style.SUCCESS("No render time regressions."))
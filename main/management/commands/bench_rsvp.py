@@ -0,0 +1,97 @@
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from main import bench, models
+
+
+def post_rsvp(url, email):
+    """Post an RSVP like a browser and return the latency and the outcome."""
+    client = Client(SERVER_NAME="localhost")
+    start = time.perf_counter()
+    try:
+        response = client.post(url, {"email": email})
+        outcome = str(response.status_code)
+    except Exception as exc:
+        outcome = type(exc).__name__
+    finally:
+        connections.close_all()
+    return (time.perf_counter() - start) * 1000, outcome
+
+
+class Command(BaseCommand):
+    help = "Load test RSVPs with concurrent submissions, some for the same email"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=500,
+            help="Number of RSVPs posted.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=50,
+            help="Number of concurrent requests.",
+        )
+        parser.add_argument(
+            "--emails",
+            type=int,
+            default=100,
+            help="Number of distinct emails, the others RSVP again concurrently.",
+        )
+
+    def handle(self, *args, **options):
+        bench.check_database()
+
+        tag = uuid.uuid4().hex[:8]
+        workshop = models.Workshop.objects.create(
+            title="Load test",
+            slug=f"bench-{tag}",
+            body="A workshop to load test RSVPs.",
+            scheduled_at=timezone.now(),
+            location_name="Newspeak House",
+            location_address="E2",
+            location_url="https://chaitinschool.org/",
+        )
+        url = reverse("workshop", args=(workshop.slug,))
+        emails = [
+            f"bench-{tag}-{i % options['emails']}@example.com"
+            for i in range(options["requests"])
+        ]
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(options["concurrency"]) as pool:
+                results = list(pool.map(lambda email: post_rsvp(url, email), emails))
+            elapsed = time.perf_counter() - start
+            attendances = models.Attendance.objects.filter(workshop=workshop).count()
+        finally:
+            workshop.delete()
+            # confirmations and admin notifications queued by the RSVPs
+            models.OutboxEmail.objects.filter(body__contains=f"bench-{tag}").delete()
+            models.AdminNotification.objects.filter(
+                body__contains=f"bench-{tag}"
+            ).delete()
+
+        timings = sorted(timing for timing, _ in results)
+        outcomes = Counter(outcome for _, outcome in results)
+        # RSVPs redirect back to the workshop page
+        errors = sum(count for outcome, count in outcomes.items() if outcome != "302")
+        self.stdout.write(
+            f"{len(results)} RSVPs in {elapsed:.2f}s"
+            f" {len(results) / elapsed:.0f} req/s"
+            f" p50={bench.percentile(timings, 50):.1f}ms"
+            f" p99={bench.percentile(timings, 99):.1f}ms"
+            f" errors={errors}"
+            f" attendances={attendances}/{min(options['emails'], len(results))}"
+        )
+        for outcome, count in sorted(outcomes.items()):
+            self.stdout.write(f"  {outcome}: {count}")
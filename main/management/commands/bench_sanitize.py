@@ -0,0 +1,96 @@
+import statistics
+import time
+
+import bleach
+from django.core.management.base import BaseCommand
+
+from main import bench, denylist, render
+
+
+def build_corpus(size):
+    """Return adversarial user plans of roughly `size` bytes each."""
+    nested_lists = ""
+    depth = 0
+    while len(nested_lists) < size:
+        nested_lists += "  " * (depth % 40) + f"- item {depth}\n"
+        depth += 1
+
+    links = ""
+    i = 0
+    while len(links) < size:
+        links += f"[link {i}](https://example.com/{i}?q=<b>{i}</b>) "
+        links += f'<a href="javascript:alert({i})" onclick="x()">{i}</a>\n'
+        i += 1
+
+    nested_html = ""
+    depth = size // 40
+    nested_html += "<div><blockquote><em>" * depth
+    nested_html += "deep"
+    nested_html += "</em></blockquote></div>" * depth
+
+    disallowed = ""
+    i = 0
+    while len(disallowed) < size:
+        disallowed += (
+            f"<script>alert({i})</script><iframe src='//evil/{i}'></iframe>"
+            f"<img src=x onerror=alert({i})><style>p{{}}</style>\n"
+        )
+        i += 1
+
+    return {
+        "nested-lists": nested_lists,
+        "links": links,
+        "nested-html": nested_html,
+        "disallowed-tags": disallowed,
+    }
+
+
+class Command(BaseCommand):
+    help = "Benchmark sanitization of large, adversarial user plans"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            type=int,
+            default=200,
+            help="Approximate size of each plan in KB.",
+        )
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=10,
+            help="Number of times each plan is sanitized.",
+        )
+
+    def bleach_clean(self, html):
+        return bleach.clean(
+            html,
+            tags=denylist.ALLOWED_HTML_ELEMENTS,
+            attributes=denylist.ALLOWED_HTML_ATTRS,
+        )
+
+    def handle(self, *args, **options):
+        corpus = build_corpus(options["size"] * 1000)
+        sanitizers = {
+            "bleach.clean": self.bleach_clean,
+            "render.sanitize_html": render.sanitize_html,
+        }
+        for name, plan in corpus.items():
+            html = render.markdown_to_html(plan)
+            self.stdout.write(
+                self.style.NOTICE(f"{name}: {len(plan)} bytes, {len(html)} bytes HTML")
+            )
+            for sanitizer_name, sanitize in sanitizers.items():
+                timings = []
+                for _ in range(options["iterations"]):
+                    start = time.perf_counter()
+                    sanitize(html)
+                    timings.append((time.perf_counter() - start) * 1000)
+                self.stdout.write(
+                    f"  {sanitizer_name:<22}"
+                    f" p50={bench.percentile(timings, 50):.1f}ms"
+                    f" p90={bench.percentile(timings, 90):.1f}ms"
+                    f" p99={bench.percentile(timings, 99):.1f}ms"
+                    f" max={max(timings):.1f}ms"
+                    f" mean={statistics.mean(timings):.1f}ms"
+                )
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main import feeds
+
+
+class Command(BaseCommand):
+    help = "Render feeds again, after deploying changes to their templates"
+
+    def handle(self, *args, **options):
+        for name in feeds.FEED_RENDERERS:
+            feed = feeds.update_feed(name)
+            if settings.FEEDS_WRITE_FILES:
+                # also when unchanged, the file may not exist yet
+                feeds.write_feed_file(feed)
+            self.stdout.write(f"{name}: {len(feed.content)} bytes, {feed.sha256}")
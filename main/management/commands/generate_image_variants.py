@@ -0,0 +1,59 @@
+import time
+from concurrent.futures import as_completed
+
+from django.core.management.base import BaseCommand
+
+from main import models, variants
+
+
+class Command(BaseCommand):
+    help = "Generate thumbnails and re-encoded variants of images not up to date"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Number of worker processes, IMAGE_VARIANT_WORKERS by default.",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Regenerate the variants of every image, even up to date ones.",
+        )
+
+    def handle(self, *args, **options):
+        queryset = models.Image.objects.filter(
+            extension__in=variants.RESIZABLE_EXTENSIONS
+        )
+        if not options["force"]:
+            # images whose variants were skipped as not smaller are done too
+            queryset = queryset.exclude(variants_version=variants.VARIANTS_VERSION)
+        image_ids = list(queryset.order_by("pk").values_list("pk", flat=True))
+
+        created = 0
+        failed = 0
+        start = time.perf_counter()
+        with variants.create_pool(options["workers"]) as pool:
+            futures = {
+                pool.submit(
+                    variants.generate_variants, image_id, options["force"]
+                ): image_id
+                for image_id in image_ids
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    created += len(future.result())
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f"image {futures[future]}: {exc}")
+                if done % 100 == 0:
+                    self.stdout.write(f"{done}/{len(image_ids)} images")
+
+        elapsed = time.perf_counter() - start
+        rate = len(image_ids) / elapsed if elapsed else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{created} variants of {len(image_ids)} images, {failed} failed "
+                f"({elapsed:.2f}s, {rate:.1f} images/s)"
+            )
+        )
@@ -0,0 +1,165 @@
+import hashlib
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image as PILImage
+
+from main import images, models, variants
+
+# same as the upload form
+IMPORT_EXTENSIONS = ["jpeg", "jpg", "png", "svg", "gif", "webp"]
+
+
+def inspect_image_file(path):
+    """Return the sha256, size and extension of an image file, or an error.
+
+    Runs in the worker processes.
+    """
+    extension = path.suffix[1:].casefold()
+    if extension == "jpg":
+        extension = "jpeg"
+    size = path.stat().st_size
+    if size > settings.IMAGE_UPLOAD_MAX_SIZE:
+        return {"path": path, "error": "too big"}
+
+    data = path.read_bytes()
+    try:
+        if extension == "svg":
+            if b"<svg" not in data[:4096]:
+                raise ValueError("no svg element")
+        else:
+            with PILImage.open(path) as picture:
+                picture.verify()
+    except Exception as exc:
+        return {"path": path, "error": f"not a valid image ({exc})"}
+    return {
+        "path": path,
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "size": size,
+        "extension": extension,
+    }
+
+
+class Command(BaseCommand):
+    help = "Import a directory of images, skipping ones uploaded before"
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", help="Directory of the images to import.")
+        parser.add_argument(
+            "--recursive",
+            action="store_true",
+            help="Also import images of subdirectories.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Number of worker processes, IMAGE_VARIANT_WORKERS by default.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=200,
+            help="Number of images inserted per transaction.",
+        )
+
+    def get_paths(self, directory, recursive):
+        pattern = "**/*" if recursive else "*"
+        return sorted(
+            path
+            for path in directory.glob(pattern)
+            if path.is_file() and path.suffix[1:].casefold() in IMPORT_EXTENSIONS
+        )
+
+    def handle(self, *args, **options):
+        directory = Path(options["directory"])
+        if not directory.is_dir():
+            raise CommandError(f"{directory} is not a directory")
+        paths = self.get_paths(directory, options["recursive"])
+
+        start = time.perf_counter()
+        with variants.create_pool(options["workers"]) as pool:
+            futures = [pool.submit(inspect_image_file, path) for path in paths]
+            inspected = [future.result() for future in futures]
+
+            files = []
+            for result in inspected:
+                if "error" in result:
+                    self.stderr.write(f"{result['path']}: skipped, {result['error']}")
+                else:
+                    files.append(result)
+
+            imported = []
+            existing = 0
+            for i in range(0, len(files), options["batch_size"]):
+                batch = files[i : i + options["batch_size"]]
+                new, found = self.import_batch(batch)
+                imported += new
+                existing += found
+
+            # thumbnails and WebP/AVIF copies, in the same pool
+            variant_futures = [
+                pool.submit(variants.generate_variants, image.pk) for image in imported
+            ]
+            variant_count = sum(len(future.result()) for future in variant_futures)
+
+        elapsed = time.perf_counter() - start
+        total_bytes = sum(result["size"] for result in files)
+        rate = len(paths) / elapsed if elapsed else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{len(imported)} imported, {existing} already uploaded, "
+                f"{len(paths) - len(files)} skipped, {variant_count} variants "
+                f"({total_bytes / 1e6:.1f} MB in {elapsed:.2f}s, "
+                f"{rate:.1f} images/s)"
+            )
+        )
+
+    def import_batch(self, batch):
+        """Insert the images of a batch not uploaded before.
+
+        Return the new images and the number of images found uploaded.
+        """
+        known = {
+            (image.sha256, image.extension): image
+            for image in models.Image.objects.filter(
+                sha256__in=[result["sha256"] for result in batch]
+            )
+        }
+        new_images = []
+        found = 0
+        for result in batch:
+            key = (result["sha256"], result["extension"])
+            image = known.get(key)
+            if image is not None:
+                found += 1
+                self.write_mapping(result["path"], image, "existing")
+                continue
+            with open(result["path"], "rb") as f:
+                path = images.store_image_file(
+                    File(f), result["sha256"], result["extension"]
+                )
+            image = models.Image(
+                name=result["path"].stem.replace(".", "-"),
+                slug=str(uuid.uuid4())[:8],
+                path=path,
+                sha256=result["sha256"],
+                size=result["size"],
+                extension=result["extension"],
+            )
+            known[key] = image
+            new_images.append(image)
+            self.write_mapping(result["path"], image, "new")
+
+        with transaction.atomic():
+            models.Image.objects.bulk_create(new_images)
+        return new_images, found
+
+    def write_mapping(self, path, image, status):
+        self.stdout.write(
+            f"{path.name}\t{image.slug}\t{image.get_absolute_url()}\t{status}"
+        )
@@ -0,0 +1,68 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from main import images, models
+
+
+class Command(BaseCommand):
+    help = "Move image bytes stored in the database to content-addressed files"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=50,
+            help="Number of images loaded and moved per batch.",
+        )
+        parser.add_argument(
+            "--vacuum",
+            action="store_true",
+            help="Run VACUUM afterwards to return the freed space to the disk.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        moved = 0
+        moved_bytes = 0
+        start = time.perf_counter()
+        pks = list(
+            models.Image.objects.filter(path="")
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        for i in range(0, len(pks), batch_size):
+            batch = list(
+                models.Image.objects.filter(pk__in=pks[i : i + batch_size]).only(
+                    "pk", "data", "extension"
+                )
+            )
+            for image in batch:
+                data = bytes(image.data)
+                image.sha256, image.path = images.store_image_data(
+                    data, image.extension
+                )
+                image.size = len(data)
+                image.data = b""
+                moved_bytes += len(data)
+            # files are written before rows point at them, so an interrupted
+            # run leaves at most orphan files, which the next run reuses
+            with transaction.atomic():
+                models.Image.objects.bulk_update(
+                    batch, ["data", "path", "sha256", "size"]
+                )
+            moved += len(batch)
+            self.stdout.write(f"{moved}/{len(pks)} images moved")
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{moved} images, {moved_bytes / 1e6:.1f} MB moved in {elapsed:.2f}s"
+            )
+        )
+
+        if options["vacuum"] and connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute("VACUUM")
+            self.stdout.write(self.style.SUCCESS("Database vacuumed."))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from main import caching
+
+
+class Command(BaseCommand):
+    help = "Show hit and miss counters of the anonymous page cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Reset the counters after showing them.",
+        )
+
+    def handle(self, *args, **options):
+        stats = caching.get_stats()
+        total = stats["hits"] + stats["misses"]
+        ratio = stats["hits"] / total * 100 if total else 0
+        self.stdout.write(
+            f"hits: {stats['hits']}, misses: {stats['misses']}, "
+            f"hit ratio: {ratio:.1f}%"
+        )
+        if options["reset"]:
+            caching.reset_stats()
+            self.stdout.write(self.style.SUCCESS("Counters reset."))
@@ -0,0 +1,90 @@
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from main import caching, models
+
+
+def get_rendered_models():
+    """Return every model that stores pre-rendered markdown HTML."""
+    return [
+        model
+        for model in apps.get_app_config("main").get_models()
+        if issubclass(model, models.RenderedMarkdownMixin)
+    ]
+
+
+class Command(BaseCommand):
+    help = "Re-render stored markdown HTML after a renderer or allowlist change"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of rows loaded and updated per batch.",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Re-render every row, even if its source hash has not changed.",
+        )
+        parser.add_argument(
+            "--model",
+            choices=[model.__name__ for model in get_rendered_models()],
+            help="Only re-render rows of this model.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        for model in get_rendered_models():
+            if options["model"] and model.__name__ != options["model"]:
+                continue
+
+            source_fields = list(model.rendered_fields)
+            html_fields = list(model.rendered_fields.values())
+            hash_fields = [f"{name}_hash" for name in html_fields]
+            update_fields = html_fields + hash_fields
+            # bulk_update sends no signal and skips auto_now, pages showing
+            # the rows are invalidated and revalidated below
+            has_updated_at = any(
+                field.name == "updated_at" for field in model._meta.fields
+            )
+            if has_updated_at:
+                update_fields.append("updated_at")
+
+            rendered = 0
+            skipped = 0
+            start = time.perf_counter()
+            pks = list(model.objects.order_by("pk").values_list("pk", flat=True))
+            for i in range(0, len(pks), batch_size):
+                batch = model.objects.filter(pk__in=pks[i : i + batch_size]).only(
+                    "pk", *source_fields, *hash_fields
+                )
+                changed = []
+                now = timezone.now()
+                for obj in batch:
+                    if obj.render_html_fields(force=options["force"]):
+                        if has_updated_at:
+                            obj.updated_at = now
+                        changed.append(obj)
+                    else:
+                        skipped += 1
+                with transaction.atomic():
+                    model.objects.bulk_update(changed, update_fields)
+                rendered += len(changed)
+
+            if rendered and model in caching.PAGE_CACHE_MODELS:
+                caching.bump_version(model)
+
+            elapsed = time.perf_counter() - start
+            rate = len(pks) / elapsed if elapsed else 0
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{model.__name__}: {rendered} rendered, {skipped} unchanged "
+                    f"({len(pks)} rows in {elapsed:.2f}s, {rate:.0f} rows/s)"
+                )
+            )
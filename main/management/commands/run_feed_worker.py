@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections
+
+from main import feeds
+
+
+class Command(BaseCommand):
+    help = "Render stale feeds, and feeds rendered too long ago, again"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once no feed is stale instead of polling for changes.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="Seconds to wait between polls when no feed is stale.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            try:
+                names = feeds.update_stale_feeds()
+            except OperationalError as exc:
+                # such as database is locked, retried on the next poll
+                self.stderr.write(f"Feed worker failed: {exc}")
+                time.sleep(options["interval"])
+                continue
+            for name in names:
+                self.stdout.write(f"{name} rendered")
+            if names:
+                # a feed changed while rendering is stale again
+                continue
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from main import broadcasts
+
+
+class Command(BaseCommand):
+    help = "Send queued broadcasts, resuming interrupted ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of polling for new jobs.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="Seconds to wait between polls of an empty queue.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            job = broadcasts.get_next_job()
+            if job is None:
+                if options["once"]:
+                    return
+                time.sleep(options["interval"])
+                continue
+
+            self.stdout.write(f"{job}: {job.status}")
+            try:
+                broadcasts.process_job(job)
+            except Exception as exc:
+                # unsent records are retried after a delay, other jobs first
+                broadcasts.mark_failed(job, exc)
+                if options["once"]:
+                    raise CommandError(f"{job} failed: {exc}") from exc
+                self.stderr.write(f"{job} failed: {exc}")
+                continue
+            self.stdout.write(self.style.SUCCESS(f"{job}: {job.total} emails sent"))
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections
+
+from main import notifications, outbox
+
+
+class Command(BaseCommand):
+    help = "Send queued transactional emails and admin digests"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once no email is due instead of polling for new ones.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1,
+            help="Seconds to wait between polls when no email is due.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            try:
+                if notifications.is_digest_due():
+                    flushed = notifications.flush_digests()
+                    self.stdout.write(f"{flushed} admin notifications flushed")
+                sent, failed = outbox.send_due()
+            except OperationalError as exc:
+                # such as database is locked, retried on the next poll
+                self.stderr.write(f"Outbox worker failed: {exc}")
+                time.sleep(options["interval"])
+                continue
+            if sent or failed:
+                # failed emails are not due again until their retry delay
+                self.stdout.write(f"{sent} emails sent, {failed} failed")
+                continue
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
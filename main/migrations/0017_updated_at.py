@@ -0,0 +1,32 @@
+# Generated by Django 6.1.2 on 2026-10-18 09:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0016_rendered_html"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="incident",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name="mentorship",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name="workshop",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 6.1.2 on 2026-10-18 09:38
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_images(apps, schema_editor):
+    Image = apps.get_model("main", "Image")
+    for image_id in list(Image.objects.values_list("id", flat=True)):
+        data = bytes(Image.objects.values_list("data", flat=True).get(id=image_id))
+        Image.objects.filter(id=image_id).update(
+            sha256=hashlib.sha256(data).hexdigest(),
+            size=len(data),
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0017_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="path",
+            field=models.CharField(blank=True, default="", max_length=200),
+        ),
+        migrations.AddField(
+            model_name="image",
+            name="sha256",
+            field=models.CharField(
+                blank=True, db_index=True, default="", max_length=64
+            ),
+        ),
+        migrations.AddField(
+            model_name="image",
+            name="size",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name="image",
+            name="data",
+            field=models.BinaryField(blank=True, default=b""),
+        ),
+        migrations.RunPython(hash_images, migrations.RunPython.noop),
+    ]
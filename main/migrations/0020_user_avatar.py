@@ -0,0 +1,27 @@
+# Generated by Django 6.1.2 on 2026-10-18 09:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0019_image_variants"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="avatar_path",
+            field=models.CharField(blank=True, default="", max_length=200),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="avatar_sha256",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="avatar_size",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.1.2 on 2026-10-18 09:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0021_broadcast_jobs"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="broadcastjob",
+            name="fan_out_cursor",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.1.2 on 2026-10-18 10:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0024_admin_notification"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Feed",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=300, unique=True)),
+                ("content", models.BinaryField()),
+                ("sha256", models.CharField(max_length=64)),
+                ("updated_at", models.DateTimeField()),
+                ("stale", models.BooleanField(default=False)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.1.2 on 2026-10-18 10:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0025_feed"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="feed",
+            name="rendered_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name="workshop",
+            name="scheduled_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 6.1.2 on 2026-10-18 10:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0026_events_feed_window"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="emailrecord",
+            name="error",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="emailrecord",
+            name="failed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.1.2 on 2026-10-18 10:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0027_emailrecord_failed_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="variants_version",
+            field=models.CharField(blank=True, default="", max_length=16),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 6.1.2 on 2026-10-18 10:51
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def set_workshops(apps, schema_editor):
+    BroadcastJob = apps.get_model("main", "BroadcastJob")
+    Workshop = apps.get_model("main", "Workshop")
+    for job in BroadcastJob.objects.exclude(ics_attachment="no-ics"):
+        # slugs are not unique, a duplicate attaches the latest scheduled
+        job.workshop = (
+            Workshop.objects.filter(slug=job.ics_attachment)
+            .order_by("-scheduled_at")
+            .first()
+        )
+        job.save(update_fields=["workshop"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0028_image_variants_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="broadcastjob",
+            name="attempts",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="broadcastjob",
+            name="failed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="broadcastjob",
+            name="last_error",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="broadcastjob",
+            name="send_after",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name="broadcastjob",
+            name="workshop",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="main.workshop",
+            ),
+        ),
+        migrations.RunPython(set_workshops, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="broadcastjob",
+            name="ics_attachment",
+        ),
+    ]
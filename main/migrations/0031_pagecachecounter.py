@@ -0,0 +1,28 @@
+# Generated by Django 6.1.2 on 2026-10-18 10:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0030_user_updated_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PageCacheCounter",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=20, unique=True)),
+                ("value", models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
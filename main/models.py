@@ -1,19 +1,79 @@
+import hashlib
 import uuid
 from base64 import b64encode
 from datetime import timedelta
 
-import bleach
-import mistune
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.urls import reverse
 from django.utils import timezone
 
-from main import denylist, validators
-
-
-class User(AbstractUser):
+from main import images, render, validators
+
+
+class RenderedMarkdownMixin:
+    """Keep the rendered HTML of markdown fields stored next to their source.
+
+    `rendered_fields` maps a markdown source field to the field storing its
+    HTML. Each HTML field has a `<name>_hash` sibling with the source hash
+    the HTML was rendered from, so unchanged sources are never re-rendered.
+    """
+
+    rendered_fields = {}
+    sanitized_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.render_missing_html_fields()
+        return instance
+
+    def render_field(self, source_field):
+        text = getattr(self, source_field)
+        if source_field in self.sanitized_fields:
+            return render.sanitized_markdown_to_html(text)
+        return render.markdown_to_html(text)
+
+    def render_missing_html_fields(self):
+        """Render HTML fields never rendered, without storing them.
+
+        Rows written without save(), such as by loaddata or before the HTML
+        fields existed, are rendered on the fly until saved or until the
+        render_markdown command runs.
+        """
+        for source_field, html_field in self.rendered_fields.items():
+            hash_field = f"{html_field}_hash"
+            loaded = self.__dict__.keys() >= {source_field, html_field, hash_field}
+            if loaded and not getattr(self, hash_field):
+                setattr(self, html_field, self.render_field(source_field))
+
+    def render_html_fields(self, force=False):
+        """Re-render stale HTML fields and return the names of fields changed."""
+        changed = []
+        for source_field, html_field in self.rendered_fields.items():
+            hash_field = f"{html_field}_hash"
+            text = getattr(self, source_field)
+            if source_field in self.sanitized_fields:
+                digest = render.source_hash(text, render.SANITIZED_SIGNATURE)
+            else:
+                digest = render.source_hash(text)
+            if not force and getattr(self, hash_field) == digest:
+                continue
+            setattr(self, html_field, self.render_field(source_field))
+            setattr(self, hash_field, digest)
+            changed += [html_field, hash_field]
+        return changed
+
+    def save(self, *args, **kwargs):
+        changed = self.render_html_fields()
+        update_fields = kwargs.get("update_fields")
+        if changed and update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, *changed}
+        super().save(*args, **kwargs)
+
+
+class User(RenderedMarkdownMixin, AbstractUser):
     username = models.CharField(
         max_length=64,
         unique=True,
@@ -28,21 +88,43 @@ class User(AbstractUser):
     last_name = None
     email = models.EmailField(unique=True)
     plan = models.TextField(blank=True)
+    plan_html = models.TextField(blank=True, default="", editable=False)
+    plan_html_hash = models.CharField(
+        max_length=64, blank=True, default="", editable=False
+    )
+
+    # resized profile picture, a content-addressed file in the default storage
+    avatar_path = models.CharField(max_length=200, blank=True, default="")
+    avatar_sha256 = models.CharField(max_length=64, blank=True, default="")
+    avatar_size = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    rendered_fields = {"plan": "plan_html"}
+    sanitized_fields = ("plan",)
 
     @property
     def displayname(self):
         return "~" + self.username
 
     @property
-    def plan_as_html(self):
-        markdown = mistune.create_markdown(plugins=["task_lists", "footnotes"])
-        dirty_html = markdown(self.plan)
-        cleaned_html = bleach.clean(
-            dirty_html,
-            tags=denylist.ALLOWED_HTML_ELEMENTS,
-            attributes=denylist.ALLOWED_HTML_ATTRS,
+    def avatar_file(self):
+        if not self.avatar_path:
+            return None
+        extension = self.avatar_path.rsplit(".", 1)[1]
+        return images.StoredFile(
+            self.avatar_path, self.avatar_sha256, self.avatar_size, extension
         )
-        return cleaned_html
+
+    def get_avatar_url(self):
+        """Return a URL that changes with the avatar, so it is cached forever."""
+        if not self.avatar_path:
+            return ""
+        path = reverse("user_avatar_raw", args=(self.username,))
+        return f"{path}?v={self.avatar_sha256[:16]}"
+
+    @property
+    def plan_as_html(self):
+        return render.sanitized_markdown_to_html(self.plan)
 
     def __str__(self):
         return self.username
@@ -61,13 +143,20 @@ class Subscription(models.Model):
         return self.email
 
 
-class Post(models.Model):
+class Post(RenderedMarkdownMixin, models.Model):
     title = models.CharField(max_length=300)
     slug = models.CharField(max_length=300)
     byline = models.CharField(max_length=300)
     body = models.TextField()
     published_at = models.DateField(null=True, blank=True)
     author = models.ForeignKey(User, null=True, on_delete=models.SET_NULL)
+    updated_at = models.DateTimeField(auto_now=True)
+    body_html = models.TextField(blank=True, default="", editable=False)
+    body_html_hash = models.CharField(
+        max_length=64, blank=True, default="", editable=False
+    )
+
+    rendered_fields = {"body": "body_html"}
 
     @property
     def is_published(self):
@@ -78,22 +167,28 @@ class Post(models.Model):
 
     @property
     def body_as_html(self):
-        markdown = mistune.create_markdown(plugins=["task_lists", "footnotes"])
-        return markdown(self.body)
+        return render.markdown_to_html(self.body)
 
     def __str__(self):
         return self.title
 
 
-class Workshop(models.Model):
+class Workshop(RenderedMarkdownMixin, models.Model):
     title = models.CharField(max_length=300)
     slug = models.CharField(max_length=300)
     body = models.TextField()
-    scheduled_at = models.DateTimeField(null=True, blank=True)
+    scheduled_at = models.DateTimeField(null=True, blank=True, db_index=True)
     location_name = models.CharField(max_length=300)
     location_address = models.CharField(max_length=300)
     location_url = models.URLField()
     is_confirmed = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    body_html = models.TextField(blank=True, default="", editable=False)
+    body_html_hash = models.CharField(
+        max_length=64, blank=True, default="", editable=False
+    )
+
+    rendered_fields = {"body": "body_html"}
 
     @property
     def is_future(self):
@@ -103,8 +198,7 @@ class Workshop(models.Model):
 
     @property
     def body_as_html(self):
-        markdown = mistune.create_markdown(plugins=["task_lists", "footnotes"])
-        return markdown(self.body)
+        return render.markdown_to_html(self.body)
 
     @property
     def gcal_url(self):
@@ -123,6 +217,12 @@ class Workshop(models.Model):
             "&output=xml"
         )
 
+    @property
+    def fragment_version(self):
+        """Digest of the fields shown in partials/workshop_item.html."""
+        key = f"{self.title}|{self.slug}|{self.scheduled_at}|{self.is_confirmed}"
+        return hashlib.md5(key.encode("utf-8")).hexdigest()
+
     @property
     def body_for_ics(self):
         return self.body.replace("\n", " ").replace("#", "")
@@ -138,11 +238,89 @@ class Workshop(models.Model):
         ordering = ["-scheduled_at"]
 
 
+class Feed(models.Model):
+    """A feed rendered whenever the rows it lists change, see main.feeds."""
+
+    name = models.CharField(max_length=300, unique=True)
+    content = models.BinaryField()
+    sha256 = models.CharField(max_length=64)
+    # only changes with the content
+    updated_at = models.DateTimeField()
+    rendered_at = models.DateTimeField(default=timezone.now)
+    # set when a row the feed lists changes, until it is rendered again
+    stale = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"Feed: {self.name}"
+
+
+class PageCacheCounter(models.Model):
+    """Hits or misses of the anonymous page cache, see main.caching."""
+
+    name = models.CharField(max_length=20, unique=True)
+    value = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Page cache {self.name}: {self.value}"
+
+
+class BroadcastJob(models.Model):
+    """A broadcast queued for run_mail_worker, see main.broadcasts."""
+
+    subject = models.CharField(max_length=300)
+    body = models.TextField()
+    # workshop whose ICS is attached, chosen when the job is queued
+    workshop = models.ForeignKey(
+        Workshop, on_delete=models.SET_NULL, null=True, blank=True
+    )
+    dry_run = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # set once an EmailRecord exists for every recipient
+    fanned_out_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    total = models.PositiveIntegerField(default=0)
+    # id of the last subscription an EmailRecord was created for
+    fan_out_cursor = models.PositiveIntegerField(default=0)
+    # pushed back after each failed attempt
+    send_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    # set once the job failed too many times, it is not retried
+    failed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    @property
+    def status(self):
+        if self.finished_at:
+            return "sent"
+        if self.failed_at:
+            return "failed"
+        if self.total:
+            return "sending"
+        return "queued"
+
+    def __str__(self):
+        return f"Broadcast: {self.subject}"
+
+
 class EmailRecord(models.Model):
     subscription = models.ForeignKey(Subscription, on_delete=models.SET_NULL, null=True)
+    job = models.ForeignKey(
+        BroadcastJob,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="records",
+    )
+    unsubscribe_url = models.CharField(max_length=300, blank=True, default="")
     subject = models.CharField(max_length=300)
     body = models.TextField()
     sent_at = models.DateTimeField(default=timezone.now, null=True)
+    # set when the SMTP server rejected the message, it is not sent again
+    failed_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default="")
 
     # email literal field in case subscription foreign key
     # is null which means user has unsubscribed
@@ -155,6 +333,47 @@ class EmailRecord(models.Model):
         return f"Email record: {self.subject}"
 
 
+class OutboxEmail(models.Model):
+    """A transactional email queued for run_outbox_worker, see main.outbox."""
+
+    subject = models.CharField(max_length=300)
+    body = models.TextField()
+    from_email = models.CharField(max_length=300)
+    to = models.JSONField()
+    # (filename, content, mimetype) of text attachments
+    attachments = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # pushed back after each failed attempt
+    send_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"Outbox email: {self.subject}"
+
+
+class AdminNotification(models.Model):
+    """An email to ADMINS buffered for the next digest, see main.notifications."""
+
+    # digests are grouped by workshop
+    workshop = models.ForeignKey(
+        Workshop, on_delete=models.SET_NULL, null=True, blank=True
+    )
+    subject = models.CharField(max_length=300)
+    body = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"Admin notification: {self.subject}"
+
+
 class Attendance(models.Model):
     workshop = models.ForeignKey(Workshop, on_delete=models.CASCADE)
     email = models.EmailField()
@@ -169,28 +388,53 @@ class Attendance(models.Model):
         return f"RSVP: {self.email} for {self.workshop.title}"
 
 
-class Mentorship(models.Model):
+class Mentorship(RenderedMarkdownMixin, models.Model):
     mentor = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=300)
     slug = models.CharField(max_length=300)
     body = models.TextField()
     is_available = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    body_html = models.TextField(blank=True, default="", editable=False)
+    body_html_hash = models.CharField(
+        max_length=64, blank=True, default="", editable=False
+    )
+
+    rendered_fields = {"body": "body_html"}
 
     @property
     def body_as_html(self):
-        markdown = mistune.create_markdown(plugins=["task_lists", "footnotes"])
-        return markdown(self.body)
+        return render.markdown_to_html(self.body)
 
     def __str__(self):
         return self.title
 
 
+class ImageManager(models.Manager):
+    """Leave image bytes out of queries, listing images never needs them."""
+
+    def get_queryset(self):
+        return super().get_queryset().defer("data")
+
+    def with_data(self):
+        return super().get_queryset()
+
+
 class Image(models.Model):
     name = models.CharField(max_length=300)  # original filename
     slug = models.CharField(max_length=300, unique=True)
-    data = models.BinaryField()
+    # bytes of images uploaded before files, see move_images_to_files
+    data = models.BinaryField(blank=True, default=b"")
+    # content-addressed file in the default storage, empty if bytes are in data
+    path = models.CharField(max_length=200, blank=True, default="")
+    sha256 = models.CharField(max_length=64, blank=True, default="", db_index=True)
+    size = models.PositiveIntegerField(default=0)
     extension = models.CharField(max_length=10)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    # variants.VARIANTS_VERSION its variants were last generated with
+    variants_version = models.CharField(max_length=16, blank=True, default="")
+
+    objects = ImageManager()
 
     class Meta:
         ordering = ["-uploaded_at"]
@@ -201,7 +445,10 @@ class Image(models.Model):
 
     @property
     def data_as_base64(self):
-        return b64encode(self.data).decode("utf-8")
+        return b64encode(self.read_data()).decode("utf-8")
+
+    def read_data(self):
+        return images.read_image_data(self)
 
     def get_absolute_url(self):
         path = reverse(
@@ -213,15 +460,42 @@ class Image(models.Model):
         return self.name
 
 
-class Incident(models.Model):
+class ImageVariant(models.Model):
+    """A resized or re-encoded copy of an image, see main.variants."""
+
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name="variants")
+    name = models.CharField(max_length=20)  # key of variants.VARIANTS
+    path = models.CharField(max_length=200)
+    sha256 = models.CharField(max_length=64)
+    size = models.PositiveIntegerField()
+    extension = models.CharField(max_length=10)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["image", "name"]
+        unique_together = [["image", "name"]]
+
+    def __str__(self):
+        return f"{self.image.name} ({self.name})"
+
+
+class Incident(RenderedMarkdownMixin, models.Model):
     published_at = models.DateTimeField(auto_now_add=True)
     happened_at = models.DateField()
     text = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+    text_html = models.TextField(blank=True, default="", editable=False)
+    text_html_hash = models.CharField(
+        max_length=64, blank=True, default="", editable=False
+    )
+
+    rendered_fields = {"text": "text_html"}
 
     @property
     def text_as_html(self):
-        markdown = mistune.create_markdown(plugins=["task_lists", "footnotes"])
-        return markdown(self.text)
+        return render.markdown_to_html(self.text)
 
     def __str__(self):
         return f"[{self.id}] {self.text[:30]}..."
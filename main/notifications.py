@@ -0,0 +1,66 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from main import models, outbox
+
+
+def notify_admins(subject, body, workshop=None):
+    """Buffer an email to ADMINS for the next digest.
+
+    Like mail_admins, call inside the transaction of the change it is about.
+    """
+    return models.AdminNotification.objects.create(
+        workshop=workshop, subject=subject, body=body
+    )
+
+
+def is_digest_due():
+    buffered = models.AdminNotification.objects.aggregate(
+        count=Count("id"), oldest=Min("created_at")
+    )
+    if not buffered["count"]:
+        return False
+    if buffered["count"] >= settings.ADMIN_DIGEST_MAX_COUNT:
+        return True
+    interval = timedelta(seconds=settings.ADMIN_DIGEST_INTERVAL)
+    return buffered["oldest"] <= timezone.now() - interval
+
+
+def get_digest(workshop, notifications):
+    """Return the subject and body of the digest of a group of notifications."""
+    if len(notifications) == 1:
+        return notifications[0].subject, notifications[0].body
+    subject = f"{len(notifications)} notifications"
+    if workshop:
+        subject += f" for {workshop.title}"
+    body = "\n\n---\n\n".join(
+        f"**{notification.subject}**\n\n{notification.body}"
+        for notification in notifications
+    )
+    return subject, body
+
+
+def flush_digests():
+    """Queue one digest per workshop of the buffered notifications.
+
+    The digests go through the outbox, run_outbox_worker sends them with
+    the other due emails over one connection. Return the number of
+    notifications flushed.
+    """
+    with transaction.atomic():
+        notifications = list(
+            models.AdminNotification.objects.select_related("workshop").order_by("id")
+        )
+        groups = {}
+        for notification in notifications:
+            groups.setdefault(notification.workshop, []).append(notification)
+        for workshop, group in groups.items():
+            outbox.enqueue_admins(*get_digest(workshop, group))
+        models.AdminNotification.objects.filter(
+            id__in=[notification.id for notification in notifications]
+        ).delete()
+    return len(notifications)
@@ -0,0 +1,114 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import mail
+from django.utils import timezone
+
+from main import models
+
+# emails loaded and sent over one connection at a time
+SEND_BATCH_SIZE = 100
+# seconds before the first retry, doubled after each failed attempt
+RETRY_DELAY = 30
+RETRY_DELAY_MAX = 60 * 60
+# failed emails are kept, but not retried, after this many attempts
+MAX_ATTEMPTS = 10
+
+
+def enqueue(message):
+    """Queue an EmailMessage for run_outbox_worker and return its row.
+
+    Call inside the transaction of the change the email is about, the
+    email is only sent if it commits.
+    """
+    return models.OutboxEmail.objects.create(
+        subject=message.subject,
+        body=message.body,
+        from_email=message.from_email,
+        to=message.to,
+        attachments=[list(attachment) for attachment in message.attachments],
+    )
+
+
+def enqueue_admins(subject, body):
+    """Queue an email to ADMINS, like mail_admins."""
+    return enqueue(
+        mail.EmailMessage(
+            subject=settings.EMAIL_SUBJECT_PREFIX + subject,
+            body=body,
+            from_email=settings.SERVER_EMAIL,
+            to=[address for _, address in settings.ADMINS],
+        )
+    )
+
+
+def build_message(email):
+    return mail.EmailMessage(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=email.to,
+        attachments=email.attachments,
+    )
+
+
+def get_retry_delay(attempts):
+    return timedelta(seconds=min(RETRY_DELAY * 2 ** (attempts - 1), RETRY_DELAY_MAX))
+
+
+def get_due_emails():
+    return models.OutboxEmail.objects.filter(
+        sent_at__isnull=True,
+        attempts__lt=MAX_ATTEMPTS,
+        send_after__lte=timezone.now(),
+    ).order_by("send_after", "id")[:SEND_BATCH_SIZE]
+
+
+def mark_failed(email, error):
+    email.attempts += 1
+    email.last_error = str(error)
+    email.send_after = timezone.now() + get_retry_delay(email.attempts)
+    email.save(update_fields=["attempts", "last_error", "send_after"])
+
+
+def send_due():
+    """Send a batch of due emails over one connection.
+
+    Return the number of emails sent and failed. Each email is marked sent
+    right after the SMTP server accepts it, a crash in between sends it
+    twice. Failed emails are retried with exponential backoff.
+    """
+    emails = list(get_due_emails())
+    if not emails:
+        return 0, 0
+
+    connection = mail.get_connection()
+    try:
+        connection.open()
+    except Exception as exc:
+        for email in emails:
+            mark_failed(email, exc)
+        return 0, len(emails)
+
+    sent = failed = 0
+    try:
+        for email in emails:
+            try:
+                connection.send_messages([build_message(email)])
+            except Exception as exc:
+                mark_failed(email, exc)
+                failed += 1
+                try:
+                    connection.close()
+                except Exception:
+                    # the connection is broken already
+                    pass
+                # the next send reconnects
+                continue
+            email.sent_at = timezone.now()
+            email.attempts += 1
+            email.save(update_fields=["sent_at", "attempts"])
+            sent += 1
+    finally:
+        connection.close()
+    return sent, failed
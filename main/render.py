@@ -0,0 +1,117 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import bleach
+import mistune
+
+from main import denylist
+
+# plugins enabled for every markdown text rendered on the website
+MARKDOWN_PLUGINS = ("task_lists", "footnotes")
+
+# maximum number of rendered documents kept in memory per process
+MARKDOWN_CACHE_SIZE = 512
+
+# identifies the renderer configuration, so that a mistune upgrade or a
+# plugin change never serves HTML rendered by the previous configuration
+MARKDOWN_SIGNATURE = (
+    f"mistune={mistune.__version__};plugins={','.join(MARKDOWN_PLUGINS)}"
+)
+
+# identifies the renderer and sanitizer configuration of user-submitted
+# markdown, which also depends on the allowlists in main.denylist
+SANITIZED_SIGNATURE = (
+    f"{MARKDOWN_SIGNATURE};bleach={bleach.__version__}"
+    f";tags={','.join(sorted(denylist.ALLOWED_HTML_ELEMENTS))}"
+    f";attrs={','.join(sorted(denylist.ALLOWED_HTML_ATTRS))}"
+)
+
+_markdown = mistune.create_markdown(plugins=list(MARKDOWN_PLUGINS))
+
+# bleach.clean builds a new Cleaner, with its own html5lib parser, walker
+# and serializer, on every call; cleaners are not thread-safe, so build
+# one per thread and reuse it
+_cleaners = threading.local()
+
+
+class RenderCache:
+    """Thread-safe LRU mapping of source hashes to rendered HTML."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            html = self._data.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def set(self, key, html):
+        with self._lock:
+            self._data[key] = html
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+markdown_cache = RenderCache(MARKDOWN_CACHE_SIZE)
+
+
+def source_hash(text, signature=MARKDOWN_SIGNATURE):
+    """Return the hex digest identifying text rendered with a configuration."""
+    digest = hashlib.sha256(signature.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def markdown_to_html(text):
+    """Render markdown text to HTML, reusing a cached result when possible."""
+    if not text:
+        return ""
+    key = source_hash(text)
+    html = markdown_cache.get(key)
+    if html is None:
+        html = _markdown(text)
+        markdown_cache.set(key, html)
+    return html
+
+
+def get_cleaner():
+    """Return the sanitizer of the current thread, building it on first use."""
+    cleaner = getattr(_cleaners, "cleaner", None)
+    if cleaner is None:
+        cleaner = bleach.sanitizer.Cleaner(
+            tags=denylist.ALLOWED_HTML_ELEMENTS,
+            attributes=denylist.ALLOWED_HTML_ATTRS,
+        )
+        _cleaners.cleaner = cleaner
+    return cleaner
+
+
+def sanitize_html(html):
+    """Strip every element and attribute not allowed by main.denylist."""
+    return get_cleaner().clean(html)
+
+
+def sanitized_markdown_to_html(text):
+    """Render user-submitted markdown text to HTML safe to embed in a page."""
+    return sanitize_html(markdown_to_html(text))
@@ -0,0 +1,74 @@
+import socketserver
+import threading
+import time
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """Speak just enough SMTP for Django's backend, then drop the message."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        self.server.record_connection()
+        self.reply("220 sink ready")
+        while line := self.rfile.readline():
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                self.reply("250 sink")
+            elif command in (b"MAIL", b"RCPT", b"RSET", b"NOOP"):
+                self.reply("250 OK")
+            elif command == b"DATA":
+                self.reply("354 end with <CRLF>.<CRLF>")
+                size = 0
+                while (data := self.rfile.readline()) not in (b".\r\n", b""):
+                    size += len(data)
+                # stand-in for the round trip to a real relay
+                time.sleep(self.server.delay)
+                self.server.record_message(size)
+                self.reply("250 queued")
+            elif command == b"QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """A local SMTP server that accepts and counts messages, for benchmarks.
+
+    Listens on a free port of 127.0.0.1 unless given one, and waits `delay`
+    seconds before accepting each message.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, delay=0):
+        super().__init__(("127.0.0.1", port), SMTPSinkHandler)
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0
+        self.bytes = 0
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def record_connection(self):
+        with self.lock:
+            self.connections += 1
+
+    def record_message(self, size):
+        with self.lock:
+            self.messages += 1
+            self.bytes += size
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
@@ -1,16 +1,74 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import smtplib
+import tempfile
+import time
 import uuid
-from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
 from datetime import timezone as pytimezone
-from unittest.mock import patch
+from io import StringIO
+from unittest.mock import Mock, patch
 
 from django.conf import settings
 from django.core import mail
-from django.test import TestCase
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends import locmem
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
-from django.utils.http import urlencode
+from django.utils.http import http_date, urlencode
+from PIL import Image as PILImage
+
+from main import (
+    bench,
+    broadcasts,
+    caching,
+    feeds,
+    images,
+    mailpool,
+    models,
+    notifications,
+    outbox,
+    render,
+    smtpsink,
+    utils,
+    variants,
+    views,
+)
+
+# uploaded image files are written here instead of MEDIA_ROOT
+TEST_MEDIA_ROOT = tempfile.mkdtemp()
+
+# every anonymous page is cached, never in the cache of the running site
+TEST_CACHES = override_settings(
+    CACHES={
+        alias: {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": alias,
+        }
+        for alias in settings.CACHES
+    }
+)
+
+
+def setUpModule():
+    TEST_CACHES.enable()
 
-from main import models, views
+
+def tearDownModule():
+    TEST_CACHES.disable()
+    shutil.rmtree(TEST_MEDIA_ROOT, ignore_errors=True)
 
 
 class UserCreationTestCase(TestCase):
@@ -224,7 +282,7 @@ class WorkshopTestCase(TestCase):
             title="Django",
             slug="django",
             body="details about django",
-            scheduled_at=datetime(2020, 2, 18, 13, 15, 0, tzinfo=pytimezone.utc),
+            scheduled_at=timezone.now(),
             is_confirmed=True,
         )
         response = self.client.get(reverse("workshop_list_ics"))
@@ -238,7 +296,7 @@ class WorkshopTestCase(TestCase):
             title="ruby",
             slug="ruby",
             body="details about ruby",
-            scheduled_at=datetime(2020, 2, 18, 13, 15, 0, tzinfo=pytimezone.utc),
+            scheduled_at=timezone.now(),
         )
         response = self.client.get(reverse("workshop_list_ics"))
         self.assertEqual(response.status_code, 200)
@@ -543,14 +601,19 @@ class BroadcastTestCase(TestCase):
                     "subject": "Workshop Announcement",
                     "body": "Hey! We're having a workshop :D",
                     "dry_run": True,
-                    "ics_attachment": "workshop-1",
+                    "ics_attachment": self.workshop.pk,
                 },
                 follow=True,
             )
 
             # verify request
             self.assertEqual(response.status_code, 200)
-            self.assertContains(response, "1 emails sent.")
+            self.assertContains(response, "Broadcast queued.")
+            self.assertEqual(models.EmailRecord.objects.count(), 0)
+
+            # verify worker
+            call_command("run_mail_worker", once=True, stdout=StringIO())
+            self.assertEqual(len(mail.outbox), 1)
 
             # verify model
             self.assertEqual(models.EmailRecord.objects.all().count(), 1)
@@ -591,14 +654,19 @@ class BroadcastTestCase(TestCase):
                     "subject": "Workshop Announcement",
                     "body": "Hey! We're having a workshop :D",
                     "dry_run": False,
-                    "ics_attachment": "workshop-1",
+                    "ics_attachment": self.workshop.pk,
                 },
                 follow=True,
             )
 
             # verify request
             self.assertEqual(response.status_code, 200)
-            self.assertContains(response, "1 emails sent.")
+            self.assertContains(response, "Broadcast queued.")
+            self.assertEqual(models.EmailRecord.objects.count(), 0)
+
+            # verify worker
+            call_command("run_mail_worker", once=True, stdout=StringIO())
+            self.assertEqual(len(mail.outbox), 1)
 
             # verify model
             self.assertEqual(models.EmailRecord.objects.all().count(), 1)
@@ -624,6 +692,299 @@ class BroadcastTestCase(TestCase):
             )
 
 
+class BroadcastWorkerTestCase(TestCase):
+    def setUp(self):
+        for i in range(3):
+            models.Subscription.objects.create(email=f"s{i}@example.com")
+        self.job = broadcasts.enqueue_broadcast(
+            subject="News", body="Hello", workshop=None, dry_run=False
+        )
+        self.user = models.User.objects.create(username="alice", is_superuser=True)
+        self.client.force_login(self.user)
+
+    def run_worker(self):
+        with patch.object(
+            broadcasts,
+            "get_connection",
+            return_value=mail.get_connection(
+                "django.core.mail.backends.locmem.EmailBackend"
+            ),
+        ):
+            call_command("run_mail_worker", once=True, stdout=StringIO())
+
+    def test_send(self):
+        self.run_worker()
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, "sent")
+        self.assertEqual(self.job.total, 3)
+        self.assertFalse(self.job.records.filter(sent_at__isnull=True).exists())
+        self.assertEqual(len(mail.outbox), 3)
+        record = self.job.records.get(email="s0@example.com")
+        self.assertIn(record.unsubscribe_url, record.body)
+        self.assertEqual(
+            mail.outbox[0].extra_headers["List-Unsubscribe"],
+            self.job.records.get(email=mail.outbox[0].to[0]).unsubscribe_url,
+        )
+
+    def test_send_renders_attachment_once(self):
+        self.job.workshop = models.Workshop.objects.create(
+            slug="workshop-1",
+            title="Django Workshop",
+            scheduled_at=timezone.now(),
+            location_name="Newspeak House",
+            location_address="E2",
+            location_url="https://g.co/",
+        )
+        self.job.save()
+        with patch.object(utils, "get_ics", wraps=utils.get_ics) as get_ics:
+            self.run_worker()
+        get_ics.assert_called_once()
+        self.assertEqual(len(mail.outbox), 3)
+        for message in mail.outbox:
+            record = self.job.records.get(email=message.to[0])
+            self.assertEqual(message.body, record.body)
+            self.assertTrue(message.body.endswith(record.unsubscribe_url + "\n"))
+            self.assertEqual(
+                message.extra_headers["List-Unsubscribe"], record.unsubscribe_url
+            )
+            raw = message.message().as_string()
+            self.assertIn('filename="chaitin-school-workshop-1.ics"', raw)
+            self.assertIn(f"To: {record.email}", raw)
+
+    def test_send_in_chunks(self):
+        with (
+            patch.object(broadcasts, "FAN_OUT_CHUNK_SIZE", 2),
+            CaptureQueriesContext(connection) as queries,
+        ):
+            self.run_worker()
+        inserts = [
+            query
+            for query in queries.captured_queries
+            if query["sql"].startswith('INSERT INTO "main_emailrecord"')
+        ]
+        self.assertEqual(len(inserts), 2)
+        self.assertEqual(len(mail.outbox), 3)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.total, 3)
+
+    def test_resume(self):
+        # crashed after creating the first chunk and sending one message
+        subscriptions = list(models.Subscription.objects.order_by("id")[:2])
+        broadcasts.create_records(self.job, subscriptions)
+        self.job.records.filter(email="s0@example.com").update(sent_at=timezone.now())
+        self.run_worker()
+        self.assertEqual(
+            [message.to[0] for message in mail.outbox],
+            ["s1@example.com", "s2@example.com"],
+        )
+        self.assertEqual(models.EmailRecord.objects.count(), 3)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, "sent")
+
+    def test_failed_job_retried_after_others(self):
+        self.job.workshop = models.Workshop.objects.create(
+            slug="workshop-1", title="Django Workshop", scheduled_at=timezone.now()
+        )
+        self.job.save()
+        later = broadcasts.enqueue_broadcast(
+            subject="Later", body="Hello", workshop=None, dry_run=False
+        )
+        with patch.object(utils, "get_ics", side_effect=ValueError("no ICS")):
+            with self.assertRaises(CommandError):
+                self.run_worker()
+            self.run_worker()
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, "queued")
+        self.assertEqual(self.job.attempts, 1)
+        self.assertEqual(self.job.last_error, "no ICS")
+        self.assertGreater(self.job.send_after, timezone.now())
+        later.refresh_from_db()
+        self.assertEqual(later.status, "sent")
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_failed_job_given_up(self):
+        self.job.attempts = broadcasts.MAX_ATTEMPTS - 1
+        broadcasts.mark_failed(self.job, ValueError("no ICS"))
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, "failed")
+        self.job.send_after = timezone.now()
+        self.job.save()
+        self.assertIsNone(broadcasts.get_next_job())
+
+    def test_deleted_workshop_sent_without_attachment(self):
+        workshop = models.Workshop.objects.create(
+            slug="workshop-1", title="Django Workshop", scheduled_at=timezone.now()
+        )
+        self.job.workshop = workshop
+        self.job.save()
+        workshop.delete()
+        self.run_worker()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].attachments, [])
+
+    def test_progress(self):
+        broadcasts.create_records(self.job, list(models.Subscription.objects.all()))
+        self.job.records.filter(email="s0@example.com").update(sent_at=timezone.now())
+        response = self.client.get(reverse("broadcast"))
+        self.assertContains(response, "sending")
+        self.assertContains(response, "1 / 3")
+
+
+class BroadcastLockTestCase(TransactionTestCase):
+    def setUp(self):
+        for i in range(3):
+            models.Subscription.objects.create(email=f"s{i}@example.com")
+        broadcasts.enqueue_broadcast(
+            subject="News", body="Hello", workshop=None, dry_run=False
+        )
+
+    def test_writes_while_sending(self):
+        sent_to = []
+
+        class CheckingEmailBackend(locmem.EmailBackend):
+            def send_messages(self, messages):
+                # another process writes while a chunk is sent
+                other = connections.create_connection("default")
+                try:
+                    other.cursor().execute("UPDATE main_subscription SET email = email")
+                finally:
+                    other.close()
+                sent_to.extend(message.to[0] for message in messages)
+                return super().send_messages(messages)
+
+        with (
+            patch.object(broadcasts, "FAN_OUT_CHUNK_SIZE", 2),
+            patch.object(broadcasts, "get_connection", CheckingEmailBackend),
+        ):
+            call_command("run_mail_worker", once=True, stdout=StringIO())
+        self.assertEqual(len(sent_to), 3)
+
+
+class FailingEmailBackend(locmem.EmailBackend):
+    def send_messages(self, messages):
+        raise smtplib.SMTPServerDisconnected("connection lost")
+
+
+class RejectingEmailBackend(locmem.EmailBackend):
+    def send_messages(self, messages):
+        for message in messages:
+            if "s1@example.com" in message.to:
+                raise smtplib.SMTPRecipientsRefused(
+                    {"s1@example.com": (550, b"No such user")}
+                )
+        return super().send_messages(messages)
+
+
+class ConnectionPoolTestCase(TestCase):
+    def get_messages(self, count):
+        return [
+            mail.EmailMessage("Hi", "Hello", to=[f"s{i}@example.com"])
+            for i in range(count)
+        ]
+
+    def test_send_to_smtp_sink(self):
+        with smtpsink.SMTPSink() as sink:
+
+            def get_connection():
+                return mail.get_connection(
+                    "django.core.mail.backends.smtp.EmailBackend",
+                    host="127.0.0.1",
+                    port=sink.port,
+                    use_tls=False,
+                )
+
+            with mailpool.ConnectionPool(get_connection, size=4) as pool:
+                sent, errors = pool.send(self.get_messages(20))
+        self.assertEqual(sent, list(range(20)))
+        self.assertEqual(errors, {})
+        self.assertEqual(sink.messages, 20)
+        self.assertEqual(sink.connections, 4)
+
+    def test_retry_on_other_connection(self):
+        # only the first connection opened fails, whichever worker opens it
+        backends = [FailingEmailBackend()]
+
+        def get_connection():
+            return backends.pop() if backends else locmem.EmailBackend()
+
+        with mailpool.ConnectionPool(get_connection, size=2) as pool:
+            sent, errors = pool.send(self.get_messages(5))
+        self.assertEqual(sent, list(range(5)))
+        self.assertEqual(errors, {})
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_give_up_after_retries(self):
+        with mailpool.ConnectionPool(FailingEmailBackend, size=2, retries=2) as pool:
+            sent, errors = pool.send(self.get_messages(3))
+        self.assertEqual(sent, [])
+        self.assertEqual(sorted(errors), [0, 1, 2])
+
+    def test_rate_limit(self):
+        limiter = mailpool.RateLimiter(100)
+        start = time.monotonic()
+        for _ in range(11):
+            limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+
+    def test_broadcast_failure_resumes(self):
+        models.Subscription.objects.create(email="s0@example.com")
+        job = broadcasts.enqueue_broadcast(
+            subject="News", body="Hello", workshop=None, dry_run=False
+        )
+        with (
+            patch.object(broadcasts, "get_connection", FailingEmailBackend),
+            self.assertRaises(CommandError),
+        ):
+            call_command("run_mail_worker", once=True, stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, "sending")
+        self.assertTrue(job.records.filter(sent_at__isnull=True).exists())
+
+    def test_broadcast_rejected_recipient(self):
+        for i in range(5):
+            models.Subscription.objects.create(email=f"s{i}@example.com")
+        job = broadcasts.enqueue_broadcast(
+            subject="News", body="Hello", workshop=None, dry_run=False
+        )
+        with (
+            patch.object(broadcasts, "FAN_OUT_CHUNK_SIZE", 2),
+            patch.object(broadcasts, "get_connection", RejectingEmailBackend),
+        ):
+            call_command("run_mail_worker", once=True, stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, "sent")
+        self.assertEqual(job.total, 5)
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            ["s0@example.com", "s2@example.com", "s3@example.com", "s4@example.com"],
+        )
+        record = job.records.get(email="s1@example.com")
+        self.assertIsNone(record.sent_at)
+        self.assertIsNotNone(record.failed_at)
+        self.assertIn("550", record.error)
+
+    def test_bench_email(self):
+        out = StringIO()
+        call_command("bench_email", subscribers=3, rsvps=2, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith("broadcast  3 messages"))
+        # confirmation per RSVP and an admin digest
+        self.assertTrue(lines[1].startswith("rsvp       3 messages"))
+        self.assertFalse(models.Subscription.objects.exists())
+        self.assertFalse(models.Workshop.objects.exists())
+        self.assertFalse(models.BroadcastJob.objects.exists())
+        self.assertFalse(models.OutboxEmail.objects.exists())
+
+    def test_bench_email_refuses_existing_subscribers(self):
+        models.Subscription.objects.create(email="subscriber@example.com")
+        with self.assertRaises(CommandError):
+            call_command("bench_email", subscribers=3, rsvps=2, stdout=StringIO())
+        self.assertEqual(models.Subscription.objects.count(), 1)
+        self.assertFalse(models.BroadcastJob.objects.exists())
+
+
+# admin notifications are flushed on the next worker poll
+@override_settings(ADMIN_DIGEST_INTERVAL=0)
 class AttendanceTestCase(TestCase):
     def setUp(self):
         self.workshop = models.Workshop.objects.create(
@@ -652,7 +1013,13 @@ class AttendanceTestCase(TestCase):
             models.Attendance.objects.all()[0].email, "attendee@example.com"
         )
 
+        # verify worker
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(models.OutboxEmail.objects.count(), 1)
+        self.assertEqual(models.AdminNotification.objects.count(), 1)
+        call_command("run_outbox_worker", once=True, stdout=StringIO())
         self.assertEqual(len(mail.outbox), 2)
+        self.assertFalse(models.OutboxEmail.objects.filter(sent_at__isnull=True))
         # verify email subjects
         subjects = [record.subject for record in mail.outbox]
         self.assertIn(f"See you at: {self.workshop.title}", subjects)
@@ -693,7 +1060,19 @@ class AttendanceTestCase(TestCase):
         self.assertIn("PRODID:chaitin-school/ics", attachment_ics[1])
         self.assertEqual(attachment_ics[2], "application/octet-stream")
 
+    def test_rsvp_duplicate_slug(self):
+        models.Workshop.objects.create(
+            title="Django again", slug=self.workshop.slug, scheduled_at=timezone.now()
+        )
+        url = reverse("workshop", args=(self.workshop.slug,))
+        response = self.client.get(url)
+        self.assertContains(response, "Django again")
+        response = self.client.post(url, {"email": "attendee@example.com"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(models.Attendance.objects.get().workshop.title, "Django again")
+
 
+@override_settings(ADMIN_DIGEST_INTERVAL=0)
 class AttendanceTwiceTestCase(TestCase):
     def setUp(self):
         self.workshop = models.Workshop.objects.create(
@@ -723,6 +1102,7 @@ class AttendanceTwiceTestCase(TestCase):
         # verify model
         self.assertEqual(models.Attendance.objects.all().count(), 1)
 
+        call_command("run_outbox_worker", once=True, stdout=StringIO())
         self.assertEqual(len(mail.outbox), 2)
         # verify email subjects
         subjects = [record.subject for record in mail.outbox]
@@ -731,6 +1111,401 @@ class AttendanceTwiceTestCase(TestCase):
             f"[chaitin] RSVP <attendee@example.com> for {self.workshop.title}", subjects
         )
 
+    def test_rsvp_looks_up_workshop_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(
+                reverse("workshop", args=(self.workshop.slug,)),
+                {"email": "attendee@example.com"},
+            )
+        workshop_queries = [
+            query
+            for query in queries.captured_queries
+            if query["sql"].startswith("SELECT") and '"main_workshop"' in query["sql"]
+        ]
+        self.assertEqual(len(workshop_queries), 1)
+
+    def test_rsvp_missing_workshop(self):
+        response = self.client.post(
+            reverse("workshop", args=("missing",)), {"email": "attendee@example.com"}
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class AttendanceLoadTestCase(TransactionTestCase):
+    def test_bench_rsvp(self):
+        out = StringIO()
+        # the in-memory test database fails concurrent writes instead of
+        # waiting for the lock like a database file
+        call_command("bench_rsvp", requests=12, concurrency=1, emails=3, stdout=out)
+        self.assertIn("errors=0 attendances=3/3", out.getvalue())
+        self.assertFalse(models.Workshop.objects.exists())
+        self.assertFalse(models.OutboxEmail.objects.exists())
+
+    def test_bench_rsvp_refuses_queued_emails(self):
+        outbox.enqueue_admins("Pending", "Not sent yet")
+        with self.assertRaises(CommandError):
+            call_command("bench_rsvp", requests=2, stdout=StringIO())
+        self.assertFalse(models.Workshop.objects.exists())
+
+    def test_percentile(self):
+        timings = list(range(1, 101))
+        self.assertEqual(bench.percentile(timings, 50), 50.5)
+        self.assertAlmostEqual(bench.percentile(timings, 99), 99.01)
+        self.assertEqual(bench.percentile([3.0], 99), 3.0)
+
+
+class OutboxTestCase(TestCase):
+    def setUp(self):
+        self.email = outbox.enqueue(
+            mail.EmailMessage(
+                "Hi", "Hello", settings.DEFAULT_FROM_EMAIL, ["a@example.com"]
+            )
+        )
+
+    def test_rsvp_rolled_back_with_email(self):
+        workshop = models.Workshop.objects.create(
+            title="Django", slug="django", scheduled_at=timezone.now()
+        )
+        with patch.object(notifications, "notify_admins", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post(
+                    reverse("workshop", args=(workshop.slug,)),
+                    {"email": "attendee@example.com"},
+                )
+        self.assertFalse(models.Attendance.objects.exists())
+        self.assertEqual(models.OutboxEmail.objects.count(), 1)
+
+    def test_retry_with_backoff(self):
+        with patch.object(
+            outbox.mail, "get_connection", return_value=FailingEmailBackend()
+        ):
+            self.assertEqual(outbox.send_due(), (0, 1))
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.attempts, 1)
+        self.assertIn("connection lost", self.email.last_error)
+        self.assertGreater(self.email.send_after, timezone.now())
+
+        # not due again until the retry delay
+        self.assertEqual(outbox.send_due(), (0, 0))
+        self.assertEqual(
+            outbox.get_retry_delay(2) - outbox.get_retry_delay(1),
+            outbox.get_retry_delay(1),
+        )
+
+        models.OutboxEmail.objects.update(send_after=timezone.now())
+        self.assertEqual(outbox.send_due(), (1, 0))
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.attempts, 2)
+        self.assertIsNotNone(self.email.sent_at)
+        self.assertEqual(mail.outbox[0].to, ["a@example.com"])
+
+    def test_give_up_after_max_attempts(self):
+        models.OutboxEmail.objects.update(attempts=outbox.MAX_ATTEMPTS)
+        self.assertEqual(outbox.send_due(), (0, 0))
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class AdminDigestTestCase(TestCase):
+    def setUp(self):
+        self.workshop = models.Workshop.objects.create(title="Django", slug="django")
+
+    @override_settings(ADMIN_DIGEST_MAX_COUNT=3)
+    def test_due_on_count(self):
+        self.assertFalse(notifications.is_digest_due())
+        for i in range(2):
+            notifications.notify_admins(f"RSVP {i}", "Body", workshop=self.workshop)
+        self.assertFalse(notifications.is_digest_due())
+        notifications.notify_admins("New subscription", "Body")
+        self.assertTrue(notifications.is_digest_due())
+
+    def test_due_on_interval(self):
+        notification = notifications.notify_admins("RSVP", "Body")
+        self.assertFalse(notifications.is_digest_due())
+        models.AdminNotification.objects.filter(id=notification.id).update(
+            created_at=timezone.now()
+            - timedelta(seconds=settings.ADMIN_DIGEST_INTERVAL)
+        )
+        self.assertTrue(notifications.is_digest_due())
+
+    def test_flush_by_workshop(self):
+        other = models.Workshop.objects.create(title="Flask", slug="flask")
+        for i in range(3):
+            notifications.notify_admins(
+                f"RSVP {i}", f"Body {i}", workshop=self.workshop
+            )
+        notifications.notify_admins("RSVP 3", "Body 3", workshop=other)
+        notifications.notify_admins("New subscription", "Body 4")
+        self.assertEqual(notifications.flush_digests(), 5)
+        self.assertFalse(models.AdminNotification.objects.exists())
+
+        with patch.object(
+            outbox.mail, "get_connection", wraps=outbox.mail.get_connection
+        ) as get_connection:
+            self.assertEqual(outbox.send_due(), (3, 0))
+        get_connection.assert_called_once()
+        digests = {message.subject: message for message in mail.outbox}
+        self.assertEqual(
+            sorted(digests),
+            [
+                "[chaitin] 3 notifications for Django",
+                "[chaitin] New subscription",
+                "[chaitin] RSVP 3",
+            ],
+        )
+        body = digests["[chaitin] 3 notifications for Django"].body
+        self.assertLess(body.index("Body 0"), body.index("Body 2"))
+        self.assertEqual(
+            digests["[chaitin] RSVP 3"].to, [address for _, address in settings.ADMINS]
+        )
+
+    def test_worker_waits_for_digest(self):
+        notifications.notify_admins("RSVP", "Body", workshop=self.workshop)
+        call_command("run_outbox_worker", once=True, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 0)
+        with override_settings(ADMIN_DIGEST_INTERVAL=0):
+            call_command("run_outbox_worker", once=True, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_worker_survives_locked_database(self):
+        notifications.notify_admins("RSVP", "Body", workshop=self.workshop)
+        flush_digests = notifications.flush_digests
+        calls = []
+
+        def locked_once():
+            calls.append(None)
+            if len(calls) == 1:
+                raise OperationalError("database is locked")
+            return flush_digests()
+
+        stderr = StringIO()
+        with (
+            override_settings(ADMIN_DIGEST_INTERVAL=0),
+            patch.object(notifications, "flush_digests", locked_once),
+        ):
+            call_command(
+                "run_outbox_worker",
+                once=True,
+                interval=0,
+                stdout=StringIO(),
+                stderr=stderr,
+            )
+        self.assertIn("database is locked", stderr.getvalue())
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class EventsFeedTestCase(TestCase):
+    def setUp(self):
+        self.workshop = models.Workshop.objects.create(
+            title="Django",
+            slug="django",
+            body="details about django",
+            scheduled_at=timezone.now(),
+            is_confirmed=True,
+        )
+
+    def test_served_from_stored_feed(self):
+        self.client.get(reverse("workshop_list_ics"))
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("workshop_list_ics"))
+        self.assertEqual(response["Content-Type"], "text/calendar")
+        self.assertContains(response, "SUMMARY:Django")
+        feed = models.Feed.objects.get(name=feeds.EVENTS_ICS)
+        self.assertEqual(response["ETag"], f'"{feed.sha256}"')
+        self.assertIn("Last-Modified", response)
+
+    def test_not_modified(self):
+        response = self.client.get(reverse("workshop_list_ics"))
+        response = self.client.get(
+            reverse("workshop_list_ics"),
+            headers={"If-None-Match": response["ETag"]},
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+        response = self.client.get(
+            reverse("workshop_list_ics"),
+            headers={"If-Modified-Since": response["Last-Modified"]},
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_updated_when_workshop_changes(self):
+        feed = feeds.get_feed(feeds.EVENTS_ICS)
+        # unconfirmed workshops are not listed, the feed does not change
+        models.Workshop.objects.create(
+            title="Ruby", slug="ruby", scheduled_at=timezone.now()
+        )
+        self.assertEqual(feeds.update_stale_feeds(), [feeds.EVENTS_ICS])
+        self.assertEqual(feeds.get_feed(feeds.EVENTS_ICS).updated_at, feed.updated_at)
+
+        self.workshop.title = "Flask"
+        self.workshop.save()
+        # served stale until the worker renders it
+        self.assertNotIn(b"Flask", bytes(feeds.get_feed(feeds.EVENTS_ICS).content))
+        call_command("run_feed_worker", once=True, stdout=StringIO())
+        updated = feeds.get_feed(feeds.EVENTS_ICS)
+        self.assertNotEqual(updated.sha256, feed.sha256)
+        self.assertIn(b"SUMMARY:Flask", bytes(updated.content))
+        self.assertFalse(updated.stale)
+
+        self.workshop.delete()
+        feeds.update_stale_feeds()
+        self.assertNotIn(b"Flask", bytes(feeds.get_feed(feeds.EVENTS_ICS).content))
+
+    def test_not_rendered_by_requests(self):
+        feeds.get_feed(feeds.EVENTS_ICS)
+        for i in range(3):
+            models.Workshop.objects.create(
+                title=f"Ruby {i}", slug=f"ruby-{i}", scheduled_at=timezone.now()
+            )
+        render = Mock(wraps=feeds.render_events_ics)
+        with patch.dict(feeds.FEED_RENDERERS, {feeds.EVENTS_ICS: render}):
+            with self.captureOnCommitCallbacks(execute=True):
+                models.Workshop.objects.filter(slug__startswith="ruby-").delete()
+            self.client.get(reverse("workshop_list_ics"))
+            render.assert_not_called()
+            self.assertTrue(models.Feed.objects.get(name=feeds.EVENTS_ICS).stale)
+
+            feeds.update_stale_feeds()
+        render.assert_called_once()
+        self.assertEqual(feeds.update_stale_feeds(), [])
+
+    def test_write_file(self):
+        with override_settings(
+            FEEDS_WRITE_FILES=True,
+            FEEDS_ROOT=os.path.join(TEST_MEDIA_ROOT, "feeds"),
+        ):
+            feeds.get_feed(feeds.EVENTS_ICS)
+            self.workshop.title = "Flask"
+            self.workshop.save()
+            with self.captureOnCommitCallbacks(execute=True):
+                feeds.update_stale_feeds()
+            path = os.path.join(settings.FEEDS_ROOT, feeds.EVENTS_ICS)
+            with open(path, "rb") as f:
+                content = f.read()
+            self.assertIn(b"SUMMARY:Flask", content)
+            feed = feeds.get_feed(feeds.EVENTS_ICS)
+            self.assertEqual(content, bytes(feed.content))
+            # served by Caddy with the validators of the app
+            response = self.client.get(reverse("workshop_list_ics"))
+            with open(path + feeds.ETAG_FILE_SUFFIX) as f:
+                self.assertEqual(f.read(), response["ETag"])
+            self.assertEqual(
+                http_date(os.stat(path).st_mtime), response["Last-Modified"]
+            )
+
+            os.remove(path)
+            call_command("generate_feeds", stdout=StringIO())
+            self.assertTrue(os.path.exists(path))
+
+    def test_rendered_again_daily(self):
+        feeds.get_feed(feeds.EVENTS_ICS)
+        self.assertEqual(feeds.update_stale_feeds(), [])
+        with patch.object(
+            timezone, "now", return_value=timezone.now() + timedelta(days=2)
+        ):
+            self.assertEqual(feeds.update_stale_feeds(), [feeds.EVENTS_ICS])
+            self.assertEqual(feeds.update_stale_feeds(), [])
+
+
+class EventsWindowTestCase(TestCase):
+    def setUp(self):
+        for slug, scheduled_at in [
+            ("archived", datetime(2020, 2, 18, 13, 15, 0, tzinfo=pytimezone.utc)),
+            ("recent", timezone.now() - timedelta(days=30)),
+            ("upcoming", timezone.now() + timedelta(days=30)),
+        ]:
+            models.Workshop.objects.create(
+                title=slug.title(),
+                slug=slug,
+                scheduled_at=scheduled_at,
+                is_confirmed=True,
+            )
+
+    def get_events(self, **params):
+        response = self.client.get(reverse("workshop_list_ics"), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/calendar")
+        content = b"".join(response.streaming_content).decode()
+        self.assertTrue(content.startswith("BEGIN:VCALENDAR"))
+        self.assertTrue(content.endswith("END:VCALENDAR\n"))
+        return content
+
+    def test_default_window(self):
+        response = self.client.get(reverse("workshop_list_ics"))
+        self.assertContains(response, "SUMMARY:Recent")
+        self.assertContains(response, "SUMMARY:Upcoming")
+        self.assertNotContains(response, "SUMMARY:Archived")
+
+    def test_since(self):
+        content = self.get_events(since="2020-01-01")
+        self.assertIn("SUMMARY:Archived", content)
+        self.assertIn("SUMMARY:Recent", content)
+        self.assertIn("SUMMARY:Upcoming", content)
+        self.assertEqual(content.count("BEGIN:VEVENT"), 3)
+
+    def test_until(self):
+        content = self.get_events(until=timezone.now().isoformat())
+        self.assertIn("SUMMARY:Recent", content)
+        self.assertNotIn("SUMMARY:Upcoming", content)
+        self.assertNotIn("SUMMARY:Archived", content)
+
+        content = self.get_events(until="2021-01-01")
+        self.assertIn("SUMMARY:Archived", content)
+        self.assertEqual(content.count("BEGIN:VEVENT"), 1)
+
+    def test_streamed_an_event_at_a_time(self):
+        response = self.client.get(
+            reverse("workshop_list_ics"), {"since": "2020-01-01"}
+        )
+        self.assertTrue(response.streaming)
+        chunks = list(response.streaming_content)
+        # the header, an event per workshop and the footer
+        self.assertEqual(len(chunks), 5)
+        self.assertTrue(chunks[1].startswith(b"BEGIN:VEVENT"))
+
+    def test_invalid_window(self):
+        for params in [
+            {"since": "yesterday"},
+            {"until": "2021-02-30"},
+            {"since": "2021-01-01", "until": "2020-01-01"},
+        ]:
+            response = self.client.get(reverse("workshop_list_ics"), params)
+            self.assertEqual(response.status_code, 400)
+
+
+class EventsStreamLockTestCase(TransactionTestCase):
+    def test_writes_while_streaming(self):
+        for i in range(3):
+            models.Workshop.objects.create(
+                title=f"Django {i}",
+                slug=f"django-{i}",
+                scheduled_at=timezone.now(),
+                is_confirmed=True,
+            )
+        with patch.object(feeds, "EVENTS_CHUNK_SIZE", 1):
+            response = self.client.get(
+                reverse("workshop_list_ics"), {"since": "2020-01-01"}
+            )
+            chunks = iter(response.streaming_content)
+            content = [next(chunks), next(chunks)]
+
+            def write():
+                try:
+                    models.Workshop.objects.filter(slug="django-2").update(
+                        title="Flask"
+                    )
+                finally:
+                    connections.close_all()
+
+            # a slow client, an admin saves a workshop between two events
+            with ThreadPoolExecutor(1) as executor:
+                executor.submit(write).result()
+            content.extend(chunks)
+        response.close()
+        self.assertEqual(b"".join(content).count(b"BEGIN:VEVENT"), 3)
+        self.assertIn(b"SUMMARY:Flask", content[3])
+
 
 class MentorshipTestCase(TestCase):
     def setUp(self):
@@ -755,6 +1530,77 @@ class MentorshipTestCase(TestCase):
         self.assertContains(response, "Django Mentorship")
 
 
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ImageGalleryTestCase(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create(username="alice", is_superuser=True)
+        self.client.force_login(self.user)
+        models.Image.objects.bulk_create(
+            models.Image(
+                name=f"image-{i}", slug=f"img{i:05}", extension="png", data=b"x" * 100
+            )
+            for i in range(60)
+        )
+
+    def test_queries_defer_data(self):
+        self.assertNotIn('"data"', str(models.Image.objects.all().query))
+        self.assertIn('"data"', str(models.Image.objects.with_data().query))
+        image = models.Image.objects.get(slug="img00000")
+        self.assertEqual(image.read_data(), b"x" * 100)
+
+    def test_gallery_paginated(self):
+        response = self.client.get(reverse("image_list"))
+        self.assertEqual(len(response.context["page_obj"]), 50)
+        self.assertContains(response, "?variant=thumb", count=50)
+        response = self.client.get(reverse("image_list"), {"page": 2})
+        self.assertEqual(len(response.context["page_obj"]), 10)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class UserAvatarTestCase(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create(username="alice")
+        self.client.force_login(self.user)
+        self.mentorship = models.Mentorship.objects.create(
+            mentor=self.user, title="Django Mentorship", slug="django", body="-"
+        )
+        with open("main/testdata/vulf.jpeg", "rb") as fp:
+            self.client.post(reverse("user_avatar"), {"file": fp})
+        self.user.refresh_from_db()
+
+    def test_avatar_resized(self):
+        self.assertTrue(self.user.avatar_path.endswith(".jpeg"))
+        self.assertIn(self.user.avatar_sha256, self.user.avatar_path)
+        with open(os.path.join(TEST_MEDIA_ROOT, self.user.avatar_path), "rb") as f:
+            self.assertEqual(PILImage.open(f).width, variants.AVATAR_WIDTH)
+
+    def test_avatar_raw(self):
+        response = self.client.get(self.user.get_avatar_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertEqual(response["ETag"], f'"{self.user.avatar_sha256}"')
+        self.assertIn("immutable", response["Cache-Control"])
+        response = self.client.get(reverse("user_avatar_raw", args=("alice",)))
+        self.assertIn("no-cache", response["Cache-Control"])
+
+    def test_mentorship_links_avatar(self):
+        response = self.client.get(reverse("mentorship_detail", args=("django",)))
+        self.assertContains(response, self.user.get_avatar_url())
+        self.assertNotContains(response, "base64")
+
+    def test_avatar_invalid(self):
+        fp = SimpleUploadedFile("photo.png", b"not a png")
+        response = self.client.post(reverse("user_avatar"), {"file": fp})
+        self.assertContains(response, "Photo is not a valid image.")
+
+    def test_avatar_remove(self):
+        self.client.post(reverse("user_avatar_remove"))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar_path, "")
+        response = self.client.get(reverse("user_avatar_raw", args=("alice",)))
+        self.assertEqual(response.status_code, 404)
+
+
 class ImageUploadTestCase(TestCase):
     def setUp(self):
         self.user = models.User.objects.create(username="alice", is_superuser=True)
@@ -767,7 +1613,66 @@ class ImageUploadTestCase(TestCase):
             self.assertEqual(models.Image.objects.get(name="vulf").extension, "jpeg")
             self.assertIsNotNone(models.Image.objects.get(name="vulf").slug)
 
+    def test_image_upload_duplicate(self):
+        with open("main/testdata/vulf.jpeg", "rb") as fp:
+            first = self.client.post(reverse("image_list"), {"file": fp})
+        with open("main/testdata/vulf.jpeg", "rb") as fp:
+            second = self.client.post(reverse("image_list"), {"file": fp})
+        self.assertEqual(models.Image.objects.count(), 1)
+        self.assertEqual(first.url, second.url)
+
+    def test_image_upload_multiple(self):
+        with open("main/testdata/vulf.jpeg", "rb") as fp:
+            data = fp.read()
+        files = [
+            SimpleUploadedFile("a.png", b"a" * 100),
+            SimpleUploadedFile("b.png", b"b" * 100),
+            SimpleUploadedFile("vulf.jpeg", data),
+            SimpleUploadedFile("copy.png", b"a" * 100),
+        ]
+        self.client.post(reverse("image_list"), {"file": files})
+        self.assertEqual(
+            sorted(models.Image.objects.values_list("name", flat=True)),
+            ["a", "b", "vulf"],
+        )
 
+    def test_image_upload_too_big(self):
+        big = SimpleUploadedFile("big.png", b"0" * (1000 * 1000 + 1))
+        response = self.client.post(reverse("image_list"), {"file": big})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "File too big")
+        self.assertFalse(models.Image.objects.exists())
+
+    def test_image_upload_too_big_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        client.get(reverse("image_list"))
+        big = SimpleUploadedFile("big.png", b"0" * (1000 * 1000 + 1))
+        # fields in the order of the form, the token after the file
+        response = client.post(
+            reverse("image_list"),
+            {
+                "file": big,
+                "csrfmiddlewaretoken": client.cookies[settings.CSRF_COOKIE_NAME].value,
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "File too big")
+
+    def test_image_upload_too_big_stores_nothing(self):
+        files = [
+            SimpleUploadedFile("small.png", b"s" * 100),
+            SimpleUploadedFile("big.png", b"0" * (1000 * 1000 + 1)),
+        ]
+        response = self.client.post(reverse("image_list"), {"file": files})
+        self.assertContains(response, "File too big")
+        self.assertFalse(models.Image.objects.exists())
+        sha256 = hashlib.sha256(b"s" * 100).hexdigest()
+        path = images.get_content_path(sha256, "png")
+        self.assertFalse(default_storage.exists(path))
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
 class ImageUploadAnonTestCase(TestCase):
     def setUp(self):
         self.user = models.User.objects.create(username="alice")
@@ -780,6 +1685,7 @@ class ImageUploadAnonTestCase(TestCase):
             self.assertFalse(models.Image.objects.filter(name="vulf").exists())
 
 
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
 class ImageRawTestCase(TestCase):
     def setUp(self):
         self.user = models.User.objects.create(username="alice", is_superuser=True)
@@ -793,9 +1699,80 @@ class ImageRawTestCase(TestCase):
             reverse("image_raw", args=(self.image.slug, self.image.extension)),
         )
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(self.image.data, response.content)
+        with open("main/testdata/vulf.jpeg", "rb") as fp:
+            self.assertEqual(b"".join(response.streaming_content), fp.read())
+
+    def test_image_stored_as_file(self):
+        self.assertEqual(bytes(self.image.data), b"")
+        self.assertEqual(
+            self.image.path, images.get_content_path(self.image.sha256, "jpeg")
+        )
+        with open(os.path.join(TEST_MEDIA_ROOT, self.image.path), "rb") as f:
+            self.assertEqual(len(f.read()), self.image.size)
+
+    def test_image_raw_cache_headers(self):
+        response = self.client.get(
+            reverse("image_raw", args=(self.image.slug, self.image.extension)),
+        )
+        self.assertEqual(response["ETag"], f'"{self.image.sha256}"')
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(response["Content-Length"], str(self.image.size))
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+    def test_image_raw_not_modified(self):
+        response = self.client.get(
+            reverse("image_raw", args=(self.image.slug, self.image.extension)),
+            headers={"If-None-Match": f'"{self.image.sha256}"'},
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], f'"{self.image.sha256}"')
+
+    def test_image_raw_range(self):
+        url = reverse("image_raw", args=(self.image.slug, self.image.extension))
+        with open("main/testdata/vulf.jpeg", "rb") as fp:
+            data = fp.read()
+        for header, expected in [
+            ("bytes=0-99", data[:100]),
+            ("bytes=100-", data[100:]),
+            ("bytes=-50", data[-50:]),
+        ]:
+            response = self.client.get(url, headers={"Range": header})
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(b"".join(response.streaming_content), expected)
+            self.assertEqual(response["Content-Length"], str(len(expected)))
+        self.assertEqual(
+            response["Content-Range"],
+            f"bytes {len(data) - 50}-{len(data) - 1}/{len(data)}",
+        )
+
+    def test_image_raw_range_not_satisfiable(self):
+        response = self.client.get(
+            reverse("image_raw", args=(self.image.slug, self.image.extension)),
+            headers={"Range": f"bytes={self.image.size}-"},
+        )
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{self.image.size}")
+        self.assertNotIn("Cache-Control", response)
+
+    def test_image_raw_range_stale_if_range(self):
+        response = self.client.get(
+            reverse("image_raw", args=(self.image.slug, self.image.extension)),
+            headers={"Range": "bytes=0-99", "If-Range": '"stale"'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Length"], str(self.image.size))
+
+    @override_settings(IMAGES_ACCEL_REDIRECT=True)
+    def test_image_raw_accel_redirect(self):
+        response = self.client.get(
+            reverse("image_raw", args=(self.image.slug, self.image.extension)),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Accel-Redirect"], "/" + self.image.path)
+        self.assertEqual(response.content, b"")
 
 
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
 class ImageRawWrongExtTestCase(TestCase):
     def setUp(self):
         self.user = models.User.objects.create(username="alice", is_superuser=True)
@@ -811,6 +1788,230 @@ class ImageRawWrongExtTestCase(TestCase):
         self.assertEqual(response.status_code, 404)
 
 
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class MoveImagesToFilesTestCase(TestCase):
+    def setUp(self):
+        with open("main/testdata/vulf.jpeg", "rb") as fp:
+            self.data = fp.read()
+        self.image = models.Image.objects.create(
+            name="vulf", slug="vulf0001", extension="jpeg", data=self.data
+        )
+
+    def test_image_raw_from_database(self):
+        # the image and its variants, bytes are read with blob I/O
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("image_raw", args=("vulf0001", "jpeg")))
+            content = b"".join(response.streaming_content)
+        self.assertEqual(content, self.data)
+        self.assertEqual(response["Content-Length"], str(len(self.data)))
+
+    def test_image_raw_range_from_database(self):
+        response = self.client.get(
+            reverse("image_raw", args=("vulf0001", "jpeg")),
+            headers={"Range": "bytes=10-19"},
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), self.data[10:20])
+
+    def test_move(self):
+        call_command("move_images_to_files", batch_size=1, stdout=StringIO())
+        self.image.refresh_from_db()
+        self.assertEqual(bytes(self.image.data), b"")
+        self.assertEqual(self.image.size, len(self.data))
+        self.assertTrue(self.image.path.endswith(self.image.sha256 + ".jpeg"))
+        self.assertEqual(self.image.read_data(), self.data)
+        response = self.client.get(reverse("image_raw", args=("vulf0001", "jpeg")))
+        self.assertEqual(b"".join(response.streaming_content), self.data)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ImageBlobLockTestCase(TransactionTestCase):
+    def test_writes_while_streaming(self):
+        with open("main/testdata/vulf.jpeg", "rb") as fp:
+            data = fp.read()
+        image = models.Image.objects.create(
+            name="vulf", slug="vulf0001", extension="jpeg", data=data
+        )
+        with patch.object(images, "RANGE_CHUNK_SIZE", 1024):
+            response = self.client.get(reverse("image_raw", args=("vulf0001", "jpeg")))
+        content = iter(response.streaming_content)
+        first = next(content)
+
+        def write():
+            try:
+                models.Image.objects.filter(pk=image.pk).update(name="renamed")
+            finally:
+                connections.close_all()
+
+        # a slow client, another request writes between two chunks
+        with ThreadPoolExecutor(1) as executor:
+            executor.submit(write).result()
+        self.assertEqual(first + b"".join(content), data)
+        response.close()
+        image.refresh_from_db()
+        self.assertEqual(image.name, "renamed")
+
+
+class InlineExecutor:
+    """Run process pool submissions in the test process and database."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def submit(self, func, *args):
+        future = Future()
+        future.set_result(func(*args))
+        return future
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ImageVariantTestCase(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create(username="alice", is_superuser=True)
+        self.client.force_login(self.user)
+        with open("main/testdata/vulf.jpeg", "rb") as fp:
+            self.client.post(reverse("image_list"), {"file": fp})
+        self.image = models.Image.objects.get(name="vulf")
+        self.url = reverse("image_raw", args=(self.image.slug, "jpeg"))
+
+    def test_generate_variants(self):
+        created = variants.generate_variants(self.image.pk)
+        self.assertIn("thumb", created)
+        self.assertIn("webp", created)
+        thumb = self.image.variants.get(name="thumb")
+        self.assertEqual((thumb.width, thumb.height), (320, 320))
+        self.assertLess(thumb.size, self.image.size)
+        self.assertEqual(variants.generate_variants(self.image.pk), [])
+
+    def test_generate_variants_new_version(self):
+        variants.generate_variants(self.image.pk)
+        thumb = self.image.variants.get(name="thumb")
+        with (
+            patch.dict(variants.SAVE_OPTIONS, {"jpeg": {"quality": 50}}),
+            patch.object(variants, "VARIANTS_VERSION", "next"),
+        ):
+            created = variants.generate_variants(self.image.pk)
+        self.assertIn("thumb", created)
+        regenerated = self.image.variants.get(name="thumb")
+        self.assertNotEqual(regenerated.sha256, thumb.sha256)
+        self.assertLess(regenerated.size, thumb.size)
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.variants_version, "next")
+
+    def test_image_raw_variant(self):
+        variants.generate_variants(self.image.pk)
+        thumb = self.image.variants.get(name="thumb")
+        response = self.client.get(self.url, {"variant": "thumb"})
+        self.assertEqual(response["ETag"], f'"{thumb.sha256}"')
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        response = self.client.get(self.url, {"variant": "original"})
+        self.assertEqual(response["ETag"], f'"{self.image.sha256}"')
+
+    def test_image_raw_accept(self):
+        variants.generate_variants(self.image.pk)
+        response = self.client.get(self.url, headers={"Accept": "image/webp,*/*"})
+        self.assertEqual(response["Content-Type"], "image/webp")
+        self.assertIn("Accept", response["Vary"])
+        response = self.client.get(self.url, headers={"Accept": "*/*"})
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertIn("Accept", response["Vary"])
+
+    def test_image_raw_without_variants(self):
+        response = self.client.get(
+            self.url, {"variant": "thumb"}, headers={"Accept": "image/webp"}
+        )
+        self.assertEqual(response["ETag"], f'"{self.image.sha256}"')
+        self.assertFalse(response.has_header("Vary"))
+
+    def test_broken_pool_replaced(self):
+        broken = Mock()
+        broken.submit.side_effect = BrokenProcessPool("worker killed")
+        with (
+            patch.object(variants, "_pool", broken),
+            patch.object(variants, "create_pool", return_value=InlineExecutor()),
+            self.assertLogs(variants.logger, "WARNING"),
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            variants.schedule_variants([self.image.pk])
+        broken.shutdown.assert_called_once()
+        self.assertTrue(self.image.variants.filter(name="thumb").exists())
+
+    def test_upload_saved_when_scheduling_fails(self):
+        with (
+            patch.object(variants, "submit_variants", side_effect=OSError),
+            self.assertLogs(variants.logger, "ERROR"),
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            response = self.client.post(
+                reverse("image_list"),
+                {"file": SimpleUploadedFile("red.png", b"r" * 100)},
+            )
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(models.Image.objects.filter(name="red").exists())
+
+    def test_backfill_command(self):
+        with patch.object(variants, "create_pool", return_value=InlineExecutor()):
+            call_command("generate_image_variants", stdout=StringIO())
+        self.assertTrue(self.image.variants.filter(name="thumb").exists())
+
+    def test_backfill_skips_generated_images(self):
+        f = io.BytesIO()
+        PILImage.new("RGB", (10, 10), "red").save(f, "PNG")
+        self.client.post(
+            reverse("image_list"), {"file": SimpleUploadedFile("red.png", f.getvalue())}
+        )
+        red = models.Image.objects.get(name="red")
+        with patch.object(variants, "create_pool", return_value=InlineExecutor()):
+            call_command("generate_image_variants", stdout=StringIO())
+            # some variants of a 10px image are not smaller than it
+            self.assertLess(red.variants.count(), len(variants.VARIANTS))
+            with patch.object(variants, "generate_variants") as generate_variants:
+                call_command("generate_image_variants", stdout=StringIO())
+                generate_variants.assert_not_called()
+                with patch.object(variants, "VARIANTS_VERSION", "next"):
+                    call_command("generate_image_variants", stdout=StringIO())
+                self.assertEqual(generate_variants.call_count, 2)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ImportImagesTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        shutil.copy("main/testdata/vulf.jpeg", os.path.join(self.directory, "a.jpg"))
+        shutil.copy("main/testdata/vulf.jpeg", os.path.join(self.directory, "b.jpeg"))
+        with open(os.path.join(self.directory, "bad.png"), "wb") as f:
+            f.write(b"not a png")
+
+    def import_images(self):
+        stdout = StringIO()
+        stderr = StringIO()
+        with patch.object(variants, "create_pool", return_value=InlineExecutor()):
+            call_command("import_images", self.directory, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_import(self):
+        stdout, stderr = self.import_images()
+        image = models.Image.objects.get()
+        self.assertEqual(image.name, "a")
+        self.assertEqual(image.extension, "jpeg")
+        self.assertEqual(image.read_data()[:2], b"\xff\xd8")
+        self.assertIn(f"a.jpg\t{image.slug}\t{image.get_absolute_url()}\tnew", stdout)
+        self.assertIn(f"b.jpeg\t{image.slug}", stdout)
+        self.assertIn("1 imported, 1 already uploaded, 1 skipped", stdout)
+        self.assertIn("bad.png: skipped", stderr)
+        self.assertTrue(image.variants.filter(name="thumb").exists())
+
+    def test_import_twice(self):
+        self.import_images()
+        stdout, _ = self.import_images()
+        self.assertEqual(models.Image.objects.count(), 1)
+        self.assertIn("0 imported, 2 already uploaded", stdout)
+
+
 class ImageRawNotFoundTestCase(TestCase):
     def setUp(self):
         self.slug = "nonexistent-slug"
@@ -821,3 +2022,388 @@ class ImageRawNotFoundTestCase(TestCase):
             reverse("image_raw", args=(self.slug, self.extension)),
         )
         self.assertEqual(response.status_code, 404)
+
+
+class MarkdownRenderTestCase(TestCase):
+    def setUp(self):
+        render.markdown_cache.clear()
+
+    def test_render(self):
+        html = render.markdown_to_html("# Title\n\n- [x] done")
+        self.assertIn("<h1>Title</h1>", html)
+        self.assertIn("task-list-item", html)
+
+    def test_render_cached(self):
+        first = render.markdown_to_html("some *text*")
+        with patch.object(render, "_markdown") as markdown:
+            second = render.markdown_to_html("some *text*")
+            markdown.assert_not_called()
+        self.assertEqual(first, second)
+        self.assertEqual(render.markdown_cache.hits, 1)
+        self.assertEqual(render.markdown_cache.misses, 1)
+
+    def test_render_cache_eviction(self):
+        cache = render.RenderCache(maxsize=2)
+        cache.set("a", "<p>a</p>")
+        cache.set("b", "<p>b</p>")
+        cache.get("a")
+        cache.set("c", "<p>c</p>")
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "<p>a</p>")
+
+    def test_source_hash_signature(self):
+        self.assertNotEqual(
+            render.source_hash("text"),
+            render.source_hash("text", signature="other"),
+        )
+
+
+class RenderedMarkdownTestCase(TestCase):
+    def test_render_on_save(self):
+        post = models.Post.objects.create(title="Post", slug="post", body="*hi*")
+        self.assertEqual(post.body_html, "<p><em>hi</em></p>\n")
+        self.assertEqual(post.body_html_hash, render.source_hash(post.body))
+
+        post.body = "**bye**"
+        post.save(update_fields=["body"])
+        post.refresh_from_db()
+        self.assertEqual(post.body_html, "<p><strong>bye</strong></p>\n")
+
+    def test_unchanged_source_not_rendered(self):
+        post = models.Post.objects.create(title="Post", slug="post", body="*hi*")
+        with patch.object(render, "markdown_to_html") as markdown_to_html:
+            post.title = "New title"
+            post.save()
+            markdown_to_html.assert_not_called()
+
+    def test_plan_sanitized(self):
+        user = models.User.objects.create(
+            username="alice", plan="hi <script>alert(1)</script>"
+        )
+        self.assertNotIn("<script>", user.plan_html)
+        response = self.client.get(reverse("user_detail", args=(user.username,)))
+        self.assertContains(response, "&lt;script&gt;")
+        self.assertNotContains(response, "<script>alert")
+
+    def test_render_missing_html_on_load(self):
+        post = models.Post.objects.create(
+            title="Post", slug="post", body="*hi*", published_at=timezone.now()
+        )
+        # like rows written by loaddata, which skips save()
+        models.Post.objects.filter(id=post.id).update(body_html="", body_html_hash="")
+        response = self.client.get(reverse("post", args=(post.slug,)))
+        self.assertContains(response, "<p><em>hi</em></p>")
+
+        post = models.Post.objects.get(id=post.id)
+        post.save(update_fields=["title"])
+        stored = models.Post.objects.values("body_html", "body_html_hash").get()
+        self.assertEqual(stored["body_html"], "<p><em>hi</em></p>\n")
+        self.assertEqual(stored["body_html_hash"], render.source_hash(post.body))
+
+    def test_render_markdown_command(self):
+        post = models.Post.objects.create(title="Post", slug="post", body="*hi*")
+        models.Post.objects.filter(id=post.id).update(body_html="", body_html_hash="")
+        out = StringIO()
+        call_command("render_markdown", stdout=out)
+        self.assertIn("Post: 1 rendered, 0 unchanged", out.getvalue())
+        post.refresh_from_db()
+        self.assertEqual(post.body_html, "<p><em>hi</em></p>\n")
+
+        out = StringIO()
+        call_command("render_markdown", "--model", "Post", stdout=out)
+        self.assertIn("Post: 0 rendered, 1 unchanged", out.getvalue())
+
+
+class SanitizeTestCase(TestCase):
+    def test_sanitize(self):
+        html = render.sanitize_html('<p onclick="x()">hi</p><iframe></iframe>')
+        self.assertEqual(html, "<p>hi</p>&lt;iframe&gt;&lt;/iframe&gt;")
+
+    def test_cleaner_reused(self):
+        self.assertIs(render.get_cleaner(), render.get_cleaner())
+
+    def test_directory_large_plan(self):
+        plan = "[link](https://example.com/) " * 5000
+        models.User.objects.create(username="alice", email="a@example.com", plan=plan)
+        with patch.object(render, "sanitize_html") as sanitize_html:
+            response = self.client.get(reverse("directory"))
+            self.assertContains(response, "alice")
+            response = self.client.get(reverse("user_detail", args=("alice",)))
+            self.assertContains(response, 'href="https://example.com/"')
+            sanitize_html.assert_not_called()
+
+
+class BenchRenderTestCase(TestCase):
+    def test_bench_render(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "bench.json")
+            options = ["--workshops", "20", "--body-size", "1", "--iterations", "1"]
+            call_command(
+                "bench_render", *options, "--output", output, stdout=StringIO()
+            )
+            with open(output) as f:
+                results = json.load(f)
+            self.assertIn("main/index.html", results["templates"])
+            self.assertIn("partials/workshop_item.html", results["templates"])
+            self.assertIn("markdown_to_html", results["markdown"])
+
+            results["templates"]["main/index.html"]["min_ms"] = 0.001
+            with open(output, "w") as f:
+                json.dump(results, f)
+            with self.assertRaisesMessage(CommandError, "main/index.html"):
+                call_command(
+                    "bench_render",
+                    *options,
+                    "--output",
+                    os.path.join(tmp, "new.json"),
+                    "--baseline",
+                    output,
+                    "--min-delta",
+                    "0",
+                    stdout=StringIO(),
+                )
+
+            # the baseline is compared before the results overwrite it
+            with self.assertRaisesMessage(CommandError, "main/index.html"):
+                call_command(
+                    "bench_render",
+                    *options,
+                    "--output",
+                    output,
+                    "--baseline",
+                    output,
+                    "--min-delta",
+                    "0",
+                    stdout=StringIO(),
+                )
+
+
+class PageCacheTestCase(TransactionTestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        caching.reset_stats()
+
+    def test_page_cached(self):
+        models.Post.objects.create(
+            title="First post",
+            slug="first-post",
+            body="I am the body",
+            published_at=datetime(2020, 2, 18),
+        )
+        response = self.client.get(reverse("blog"))
+        self.assertEqual(response["X-Page-Cache"], "miss")
+        response = self.client.get(reverse("blog"))
+        self.assertEqual(response["X-Page-Cache"], "hit")
+        self.assertContains(response, "First post")
+        self.assertEqual(caching.get_stats(), {"hits": 1, "misses": 1})
+
+    def test_page_invalidated(self):
+        post = models.Post.objects.create(
+            title="First post",
+            slug="first-post",
+            body="I am the body",
+            published_at=datetime(2020, 2, 18),
+        )
+        self.client.get(reverse("post", args=(post.slug,)))
+        post.body = "I am the new body"
+        post.save()
+        response = self.client.get(reverse("post", args=(post.slug,)))
+        self.assertEqual(response["X-Page-Cache"], "miss")
+        self.assertContains(response, "I am the new body")
+
+        post.delete()
+        response = self.client.get(reverse("blog"))
+        self.assertEqual(response["X-Page-Cache"], "miss")
+        self.assertNotContains(response, "First post")
+
+    def test_page_invalidated_by_deploy(self):
+        self.client.get(reverse("blog"))
+        with override_settings(DEPLOY_VERSION="next"):
+            response = self.client.get(reverse("blog"))
+        self.assertEqual(response["X-Page-Cache"], "miss")
+
+    def test_page_invalidated_by_render_markdown(self):
+        post = models.Post.objects.create(
+            title="First post",
+            slug="first-post",
+            body="I am the body",
+            published_at=datetime(2020, 2, 18),
+        )
+        url = reverse("post", args=(post.slug,))
+        etag = self.client.get(url)["ETag"]
+        # like a renderer change, the stored HTML is out of date
+        models.Post.objects.filter(id=post.id).update(
+            body_html="<p>old renderer</p>", body_html_hash=""
+        )
+        call_command("render_markdown", "--model", "Post", stdout=StringIO())
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Page-Cache"], "miss")
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_page_not_cached_for_users(self):
+        user = models.User.objects.create(username="alice")
+        self.client.force_login(user)
+        self.client.get(reverse("coc"))
+        response = self.client.get(reverse("coc"))
+        self.assertFalse(response.has_header("X-Page-Cache"))
+
+    def test_page_with_csrf_form_not_cached(self):
+        future_year = timezone.now().year + 10
+        workshop = models.Workshop.objects.create(
+            title="Django",
+            slug="django",
+            body="details about django",
+            scheduled_at=datetime(future_year, 2, 18, 13, 15, 0, tzinfo=pytimezone.utc),
+            is_confirmed=True,
+        )
+        self.client.get(reverse("workshop", args=(workshop.slug,)))
+        response = self.client.get(reverse("workshop", args=(workshop.slug,)))
+        self.assertFalse(response.has_header("X-Page-Cache"))
+        self.assertEqual(caching.get_stats(), {"hits": 0, "misses": 0})
+
+    def test_page_cached_not_modified(self):
+        self.client.get(reverse("coc"))
+        response = self.client.get(reverse("coc"))
+        self.assertEqual(response["X-Page-Cache"], "hit")
+        response = self.client.get(
+            reverse("coc"), headers={"if-none-match": response["ETag"]}
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_page_cache_stats_command(self):
+        self.client.get(reverse("coc"))
+        self.client.get(reverse("coc"))
+        out = StringIO()
+        call_command("page_cache_stats", "--reset", stdout=out)
+        self.assertIn("hits: 1, misses: 1, hit ratio: 50.0%", out.getvalue())
+        self.assertEqual(caching.get_stats(), {"hits": 0, "misses": 0})
+
+    def test_page_cache_stats_written_at_intervals(self):
+        self.client.get(reverse("coc"))
+        self.assertFalse(models.PageCacheCounter.objects.exists())
+        with override_settings(PAGE_CACHE_STATS_INTERVAL=0):
+            self.client.get(reverse("coc"))
+            self.client.get(reverse("coc"))
+        self.assertEqual(
+            dict(models.PageCacheCounter.objects.values_list("name", "value")),
+            {"hits": 2, "misses": 1},
+        )
+
+
+class WorkshopFragmentCacheTestCase(TestCase):
+    def setUp(self):
+        caches["fragments"].clear()
+        self.workshop = models.Workshop.objects.create(
+            title="Django",
+            slug="django",
+            body="details about django",
+            scheduled_at=datetime(2020, 2, 18, 13, 15, 0, tzinfo=pytimezone.utc),
+            is_confirmed=True,
+        )
+
+    def get_fragment_key(self):
+        return make_template_fragment_key(
+            "workshop_item",
+            [self.workshop.id, self.workshop.fragment_version, False],
+        )
+
+    def test_fragment_cached(self):
+        self.client.get(reverse("workshop_list"))
+        self.assertIn("Django", caches["fragments"].get(self.get_fragment_key()))
+
+    def test_fragment_version(self):
+        self.client.get(reverse("workshop_list"))
+        self.workshop.title = "Ruby"
+        self.workshop.save()
+        response = self.client.get(reverse("workshop_list"))
+        self.assertContains(response, "Ruby")
+        self.assertNotContains(response, "Django")
+        self.assertIn("Ruby", caches["fragments"].get(self.get_fragment_key()))
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        # deletion times recorded by other tests would be the last modification
+        caching.get_cache().clear()
+        self.post = models.Post.objects.create(
+            title="First post",
+            slug="first-post",
+            body="I am the body",
+            published_at=datetime(2020, 2, 18),
+        )
+
+    def test_etag(self):
+        url = reverse("post", args=(self.post.slug,))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+        self.post.body = "I am the new body"
+        self.post.save()
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_etag_changes_with_deploy(self):
+        url = reverse("post", args=(self.post.slug,))
+        etag = self.client.get(url)["ETag"]
+        with override_settings(DEPLOY_VERSION="next"):
+            response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_validators_change_with_author(self):
+        self.post.author = models.User.objects.create(
+            username="alice", email="alice@example.com"
+        )
+        self.post.save()
+        url = reverse("post", args=(self.post.slug,))
+        response = self.client.get(url)
+        etag = response["ETag"]
+        last_modified = response["Last-Modified"]
+        with patch.object(timezone, "now", return_value=timezone.now() + timedelta(1)):
+            self.post.author.username = "alice-renamed"
+            self.post.author.save()
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertContains(response, "alice-renamed")
+        response = self.client.get(url, headers={"if-modified-since": last_modified})
+        self.assertContains(response, "alice-renamed")
+
+    def test_last_modified(self):
+        response = self.client.get(reverse("blog"))
+        last_modified = response["Last-Modified"]
+        response = self.client.get(
+            reverse("blog"), headers={"if-modified-since": last_modified}
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_last_modified_after_delete(self):
+        models.Post.objects.create(
+            title="Second post",
+            slug="second-post",
+            body="I am the body",
+            published_at=datetime(2020, 2, 19),
+        )
+        response = self.client.get(reverse("blog"))
+        last_modified = response["Last-Modified"]
+        with patch.object(timezone, "now", return_value=timezone.now() + timedelta(1)):
+            self.post.delete()
+        response = self.client.get(
+            reverse("blog"), headers={"if-modified-since": last_modified}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "First post")
+
+    def test_not_found(self):
+        response = self.client.get(reverse("post", args=("nonexistent",)))
+        self.assertEqual(response.status_code, 404)
+
+    def test_authenticated(self):
+        self.client.force_login(models.User.objects.create(username="alice"))
+        response = self.client.get(reverse("post", args=(self.post.slug,)))
+        self.assertFalse(response.has_header("ETag"))
@@ -88,6 +88,7 @@ urlpatterns += [
     path("directory/", views.Directory.as_view(), name="directory"),
     path("profile/", views.profile, name="profile"),
     path("~<slug:username>/", views.UserDetail.as_view(), name="user_detail"),
+    path("~<slug:username>/avatar/", views.user_avatar_raw, name="user_avatar_raw"),
     path("accounts/logout/", views.Logout.as_view(), name="logout"),
     path("accounts/", include("django.contrib.auth.urls")),
     path("accounts/create/", views.UserCreate.as_view(), name="user_create"),
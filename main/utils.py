@@ -2,8 +2,6 @@ from datetime import datetime, timedelta
 
 from django.conf import settings
 
-from main import models
-
 
 def get_protocol():
     if settings.DEBUG:
@@ -64,20 +62,13 @@ def get_email_body_footer(unsubscribe_url):
     return body_footer
 
 
-def get_email_attachments(workshop_slug):
-    """Return attachments array with ICS event."""
-    attachments = []
-    if workshop_slug != "no-ics":
-        workshop = models.Workshop.objects.get(slug=workshop_slug)
-        ics_content = get_ics(workshop)
-        attachments.append(
-            (
-                f"{settings.PROJECT_NAME_SLUG}-{workshop.slug}.ics",
-                ics_content,
-                "application/octet-stream",
-            ),
-        )
-    return attachments
+def get_ics_attachment(workshop):
+    """Return attachment tuple of the ICS event of a workshop."""
+    return (
+        f"{settings.PROJECT_NAME_SLUG}-{workshop.slug}.ics",
+        get_ics(workshop),
+        "application/octet-stream",
+    )
 
 
 def get_workshop_for_email(workshop):
@@ -0,0 +1,227 @@
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.db import transaction
+from PIL import Image as PILImage
+from PIL import ImageOps, features
+
+from main import images, models
+
+logger = logging.getLogger(__name__)
+
+# svg is vector and has nothing to resize
+RESIZABLE_EXTENSIONS = ["jpeg", "png", "gif", "webp"]
+
+# a format of None keeps the format of the original
+VARIANTS = {
+    "thumb": {"width": 320, "format": None},
+    "content": {"width": 1200, "format": None},
+    "webp": {"width": 1200, "format": "webp"},
+}
+if features.check("avif"):
+    VARIANTS["avif"] = {"width": 1200, "format": "avif"}
+
+# profile pictures are shown at most 200px wide, twice that for dense screens
+AVATAR_WIDTH = 400
+
+# served instead of the original to browsers accepting them, best first
+NEGOTIATED_VARIANTS = ["avif", "webp"]
+
+PIL_FORMATS = {
+    "jpeg": "JPEG",
+    "png": "PNG",
+    "gif": "GIF",
+    "webp": "WEBP",
+    "avif": "AVIF",
+}
+SAVE_OPTIONS = {
+    "jpeg": {"quality": 85, "optimize": True, "progressive": True},
+    "png": {"optimize": True},
+    "webp": {"quality": 80, "method": 4},
+    "avif": {"quality": 60},
+}
+
+# stored on images once their variants are generated, images are generated
+# again only when the variants or their encoding change
+VARIANTS_VERSION = hashlib.sha256(
+    json.dumps([VARIANTS, SAVE_OPTIONS], sort_keys=True).encode()
+).hexdigest()[:16]
+
+
+def render_variant(data, extension, spec):
+    """Return the bytes, extension, width and height of a variant of an image.
+
+    Return None for animated images, whose frames would be lost.
+    """
+    with PILImage.open(io.BytesIO(data)) as original:
+        if getattr(original, "is_animated", False):
+            return None
+        picture = ImageOps.exif_transpose(original)
+        if picture.width > spec["width"]:
+            height = max(1, round(picture.height * spec["width"] / picture.width))
+            picture = picture.resize((spec["width"], height), PILImage.LANCZOS)
+
+        extension = spec["format"] or extension
+        if extension == "jpeg" and picture.mode not in ("RGB", "L"):
+            picture = picture.convert("RGB")
+        elif extension != "gif" and picture.mode == "P":
+            picture = picture.convert("RGBA")
+
+        output = io.BytesIO()
+        picture.save(output, PIL_FORMATS[extension], **SAVE_OPTIONS.get(extension, {}))
+        return output.getvalue(), extension, picture.width, picture.height
+
+
+def resize_avatar(data, extension):
+    """Return the bytes of an avatar at most AVATAR_WIDTH pixels wide.
+
+    Raise ValueError if the data is not an image Pillow can read.
+    """
+    spec = {"width": AVATAR_WIDTH, "format": None}
+    try:
+        rendered = render_variant(data, extension, spec)
+    except (OSError, PILImage.DecompressionBombError) as exc:
+        raise ValueError("not a valid image") from exc
+    if rendered is None or len(rendered[0]) >= len(data):
+        return data
+    return rendered[0]
+
+
+def generate_variants(image_id, force=False):
+    """Create or replace the variants of an image and return their names.
+
+    Images already generated with VARIANTS_VERSION are skipped, unless
+    force is set. Variants that would not be smaller than the original are
+    skipped, the original is served instead. The image is marked generated
+    with VARIANTS_VERSION.
+    """
+    image = models.Image.objects.get(pk=image_id)
+    if image.extension not in RESIZABLE_EXTENSIONS:
+        return []
+    if image.variants_version == VARIANTS_VERSION and not force:
+        return []
+    data = image.read_data()
+
+    created = []
+    for name, spec in VARIANTS.items():
+        rendered = render_variant(data, image.extension, spec)
+        if rendered is None:
+            continue
+        content, extension, width, height = rendered
+        if len(content) >= len(data):
+            continue
+        sha256, path = images.store_image_data(content, extension)
+        created.append(
+            models.ImageVariant(
+                image=image,
+                name=name,
+                path=path,
+                sha256=sha256,
+                size=len(content),
+                extension=extension,
+                width=width,
+                height=height,
+            )
+        )
+
+    # a single statement, since workers write concurrently and SQLite fails
+    # transactions that start reading then write while another one writes
+    models.ImageVariant.objects.bulk_create(
+        created,
+        update_conflicts=True,
+        unique_fields=["image", "name"],
+        update_fields=["path", "sha256", "size", "extension", "width", "height"],
+    )
+    # variants of an older version no longer generated, such as not smaller
+    image.variants.exclude(name__in=[variant.name for variant in created]).delete()
+    # including variants skipped as not smaller, not to try them again
+    models.Image.objects.filter(pk=image_id).update(variants_version=VARIANTS_VERSION)
+    return [variant.name for variant in created]
+
+
+def create_pool(max_workers=None):
+    # spawned workers set Django up on their own instead of inheriting the
+    # open database connections and threads of the parent
+    return ProcessPoolExecutor(
+        max_workers=max_workers or settings.IMAGE_VARIANT_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=django.setup,
+    )
+
+
+_pool = None
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = create_pool()
+    return _pool
+
+
+def reset_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
+
+
+def submit_variants(image_id):
+    try:
+        return get_pool().submit(generate_variants, image_id)
+    except BrokenProcessPool:
+        # a worker died, such as killed for memory decoding a large image,
+        # and the pool refuses new work
+        logger.warning("image variant pool broken, starting a new one")
+        reset_pool()
+        return get_pool().submit(generate_variants, image_id)
+
+
+def log_failure(future):
+    if future.exception():
+        logger.error("image variants failed", exc_info=future.exception())
+
+
+def schedule_variants(image_ids):
+    """Generate variants of images in the process pool, after commit."""
+
+    def submit():
+        try:
+            for image_id in image_ids:
+                submit_variants(image_id).add_done_callback(log_failure)
+        except Exception:
+            # the images are saved, generate_image_variants catches up
+            logger.exception("image variants not scheduled")
+
+    transaction.on_commit(submit)
+
+
+def select_variant(request, image):
+    """Return the image or variant to serve and whether Accept chose it.
+
+    A variant can be asked for with ?variant=<name>, or ?variant=original
+    for the uploaded file. Otherwise the best format the browser accepts is
+    served. Variants not generated yet fall back to the original.
+    """
+    name = request.GET.get("variant")
+    if name:
+        if name == "original":
+            return image, False
+        return image.variants.filter(name=name).first() or image, False
+
+    negotiable = {
+        variant.name: variant
+        for variant in image.variants.filter(name__in=NEGOTIATED_VARIANTS)
+    }
+    accept = request.headers.get("Accept", "")
+    for name in NEGOTIATED_VARIANTS:
+        if name in negotiable and f"image/{name}" in accept:
+            return negotiable[name], True
+    return image, bool(negotiable)
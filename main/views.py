@@ -1,4 +1,5 @@
 import uuid
+from datetime import datetime, time
 
 from django.conf import settings
 from django.contrib import messages
@@ -8,21 +9,46 @@ from django.contrib.auth.views import LogoutView as DjLogoutView
 from django.contrib.messages.views import SuccessMessageMixin
 from django.core import mail
 from django.core.exceptions import PermissionDenied
-from django.core.mail import mail_admins
-from django.db.models import Q
-from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.core.paginator import Paginator
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse_lazy
 from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.decorators import method_decorator
+from django.utils.functional import cached_property
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.views.decorators.http import require_POST
-from django.views.generic import DetailView, ListView
+from django.views.generic import DetailView, ListView, View
 from django.views.generic.edit import CreateView, DeleteView, FormView, UpdateView
 
-from main import forms, mixins, models, utils
+from main import (
+    broadcasts,
+    caching,
+    feeds,
+    forms,
+    images,
+    mixins,
+    models,
+    notifications,
+    outbox,
+    utils,
+    variants,
+)
 
 
 class Directory(ListView):
-    model = models.User
+    # plans can be hundreds of KB each and the directory only lists usernames
+    queryset = models.User.objects.only("username")
 
 
 def profile(request):
@@ -57,7 +83,8 @@ class UserDetail(DetailView):
 
     def get_queryset(self):
         username = self.kwargs["username"]
-        queryset = models.User.objects.filter(username=username)
+        # the profile only shows the stored HTML, not the markdown source
+        queryset = models.User.objects.filter(username=username).defer("plan")
         return queryset
 
 
@@ -99,22 +126,26 @@ class UserAvatar(LoginRequiredMixin, FormView):
     def post(self, request, *args, **kwargs):
         form_class = self.get_form_class()
         form = self.get_form(form_class)
-        file = request.FILES["file"]
         if form.is_valid():
+            file = form.cleaned_data["file"]
             name_ext_parts = file.name.rsplit(".", 1)
             self.extension = name_ext_parts[1].casefold()
             if self.extension == "jpg":
                 self.extension = "jpeg"
 
-            data = file.read()
             # file limit ~1MB
-            if len(data) > 1.2 * 1000 * 1000:
+            if file.size > 1.2 * 1000 * 1000:
                 form.add_error("file", "Photo too big. Limit is 1MB.")
                 return self.form_invalid(form)
 
-            request.user.avatar_data = data
-            request.user.avatar_ext = self.extension
-            request.user.save()
+            try:
+                data = variants.resize_avatar(file.read(), self.extension)
+            except ValueError:
+                form.add_error("file", "Photo is not a valid image.")
+                return self.form_invalid(form)
+
+            sha256, path = images.store_image_data(data, self.extension)
+            set_avatar(request.user, path, sha256, len(data))
             return self.form_valid(form)
         else:
             return self.form_invalid(form)
@@ -126,12 +157,35 @@ class UserAvatarRemove(LoginRequiredMixin, FormView):
 
     def form_valid(self, form):
         super().form_valid(form)
-        self.request.user.avatar_data = b""
-        self.request.user.avatar_ext = ""
-        self.request.user.save()
+        set_avatar(self.request.user, "", "", 0)
         return HttpResponseRedirect(self.get_success_url())
 
 
+def set_avatar(user, path, sha256, size):
+    user.avatar_path = path
+    user.avatar_sha256 = sha256
+    user.avatar_size = size
+    user.save(update_fields=["avatar_path", "avatar_sha256", "avatar_size"])
+    # mentorship pages link to the avatar URL, which changes with it
+    models.Mentorship.objects.filter(mentor=user).update(updated_at=timezone.now())
+
+
+def user_avatar_raw(request, username):
+    user = get_object_or_404(
+        models.User.objects.only(
+            "username", "avatar_path", "avatar_sha256", "avatar_size"
+        ),
+        username=username,
+    )
+    if not user.avatar_path:
+        raise Http404()
+    # the URL of templates carries the hash, older or bare URLs revalidate
+    immutable = request.GET.get("v") == user.avatar_sha256[:16]
+    return images.serve_image(request, user.avatar_file, immutable=immutable)
+
+
+@caching.cache_anonymous_page(models.Post, models.Workshop)
+@caching.conditional_page(models.Post, models.Workshop)
 def index(request):
     if request.method == "GET" or request.method == "HEAD":
         post_list = models.Post.objects.all().order_by("-published_at")
@@ -192,18 +246,22 @@ def index(request):
             return redirect("index")
 
         # this branch only executes if form is valid
-        form.save()
         submitter_email = form.cleaned_data["email"]
-        mail_admins(
-            f"New subscription: {submitter_email}",
-            f"Someone new has subscribed to the {settings.PROJECT_NAME} list. Hooray!\n"
-            + f"\nIt's {submitter_email}\n",
-        )
+        with transaction.atomic():
+            form.save()
+            notifications.notify_admins(
+                f"New subscription: {submitter_email}",
+                f"Someone new has subscribed to the {settings.PROJECT_NAME} list."
+                + " Hooray!\n"
+                + f"\nIt's {submitter_email}\n",
+            )
 
         messages.success(request, "Thanks! Email saved—we’ll be in touch soon!")
         return redirect("index")
 
 
+@method_decorator(caching.cache_anonymous_page(models.Workshop), name="dispatch")
+@method_decorator(caching.conditional_page(models.Workshop), name="get")
 class WorkshopList(ListView):
     queryset = models.Workshop.objects.filter(scheduled_at__isnull=False)
 
@@ -246,22 +304,49 @@ class WorkshopList(ListView):
         return context
 
 
-class WorkshopListICS(ListView):
-    template_name = "main/workshop_list_ics.html"
-    content_type = "text/calendar"
-    queryset = models.Workshop.objects.filter(scheduled_at__isnull=False)
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-
-        context["workshop_list"] = models.Workshop.objects.filter(
-            is_confirmed=True,
-            scheduled_at__isnull=False,
-        ).order_by("-scheduled_at")
-
-        return context
+def parse_window_bound(value):
+    """Parse a date or datetime of ?since= or ?until=, None if missing."""
+    if not value:
+        return None
+    bound = parse_datetime(value)
+    if bound is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(f"Invalid date: {value}")
+        bound = datetime.combine(date, time.min)
+    if timezone.is_naive(bound):
+        bound = timezone.make_aware(bound)
+    return bound
+
+
+class WorkshopListICS(View):
+    """The feed of confirmed workshops scheduled within a window.
+
+    The default window is stored and rendered when a workshop changes, a
+    window given with ?since= and ?until= is streamed an event at a time.
+    """
+
+    def get(self, request):
+        if "since" not in request.GET and "until" not in request.GET:
+            feed = feeds.get_feed(feeds.EVENTS_ICS)
+            return feeds.serve_feed(request, feed, "text/calendar")
+
+        try:
+            since, until = feeds.get_events_window(
+                since=parse_window_bound(request.GET.get("since")),
+                until=parse_window_bound(request.GET.get("until")),
+            )
+        except ValueError as exc:
+            return HttpResponseBadRequest(str(exc))
+        if since > until:
+            return HttpResponseBadRequest("since is after until")
+        return StreamingHttpResponse(
+            feeds.iter_events_ics(since, until), content_type="text/calendar"
+        )
 
 
+# not in the page cache, the RSVP form has a CSRF token bound to the visitor
+@method_decorator(caching.conditional_page(models.Workshop, lookup="slug"), name="get")
 class AttendanceView(SuccessMessageMixin, FormView):
     form_class = forms.AttendanceForm
     template_name = "main/workshop_detail.html"
@@ -270,40 +355,48 @@ class AttendanceView(SuccessMessageMixin, FormView):
     def get_success_url(self):
         return reverse_lazy("workshop", args=(self.kwargs["slug"],))
 
+    @cached_property
+    def workshop(self):
+        # slugs are not unique, a duplicate shows the latest scheduled
+        workshop = models.Workshop.objects.filter(slug=self.kwargs["slug"]).first()
+        if workshop is None:
+            raise Http404()
+        return workshop
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        workshops = models.Workshop.objects.filter(slug=self.kwargs["slug"])
-        if not workshops:
-            raise Http404()
-        context["workshop"] = workshops.first()
+        context["workshop"] = self.workshop
         return context
 
     def form_valid(self, form):
-        workshop = models.Workshop.objects.get(slug=self.kwargs["slug"])
-        attendances = models.Attendance.objects.filter(
-            email=form.cleaned_data["email"], workshop=workshop
-        )
-        if attendances:
-            # RSVP for email + workshop already exists
-            form.add_error("email", "Email already RSVPed for this workshop.")
-            self.success_message = "Already RSVPed. Reminder sent!"
-            obj = attendances.first()
-        else:
-            obj = form.save(commit=False)
-            obj.workshop = workshop
-            obj.save()
-
-        mail.EmailMessage(
-            subject=f"See you at: {obj.workshop.title}",
-            body=utils.get_workshop_for_email(obj.workshop),
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[obj.email],
-            attachments=utils.get_email_attachments(obj.workshop.slug),
-        ).send()
-        mail_admins(
-            f"RSVP <{obj.email}> for {obj.workshop.title}",
-            f"**RSVP**\n\n<{obj.email}>" + f"\n\n**Workshop**\n\n{obj.workshop.title}",
-        )
+        email = form.cleaned_data["email"]
+        workshop = self.workshop
+        # emails are sent by run_outbox_worker, once the RSVP is committed
+        with transaction.atomic():
+            # insert first, the unique constraint catches concurrent RSVPs
+            # and the transaction takes the write lock with its first query
+            try:
+                with transaction.atomic():
+                    models.Attendance.objects.create(workshop=workshop, email=email)
+            except IntegrityError:
+                # RSVP for email + workshop already exists
+                form.add_error("email", "Email already RSVPed for this workshop.")
+                self.success_message = "Already RSVPed. Reminder sent!"
+
+            outbox.enqueue(
+                mail.EmailMessage(
+                    subject=f"See you at: {workshop.title}",
+                    body=utils.get_workshop_for_email(workshop),
+                    from_email=settings.DEFAULT_FROM_EMAIL,
+                    to=[email],
+                    attachments=[utils.get_ics_attachment(workshop)],
+                )
+            )
+            notifications.notify_admins(
+                f"RSVP <{email}> for {workshop.title}",
+                f"**RSVP**\n\n<{email}>" + f"\n\n**Workshop**\n\n{workshop.title}",
+                workshop=workshop,
+            )
         return super().form_valid(form)
 
 
@@ -311,12 +404,14 @@ def workshop_ics(request, slug):
     workshop = get_object_or_404(models.Workshop, slug=slug)
     ics_content = utils.get_ics(workshop)
     response = HttpResponse(ics_content, content_type="application/octet-stream")
-    response[
-        "Content-Disposition"
-    ] = f"attachment; filename={settings.PROJECT_NAME_SLUG}-{workshop.slug}.ics"
+    response["Content-Disposition"] = (
+        f"attachment; filename={settings.PROJECT_NAME_SLUG}-{workshop.slug}.ics"
+    )
     return response
 
 
+@method_decorator(caching.cache_anonymous_page(models.Post), name="dispatch")
+@method_decorator(caching.conditional_page(models.Post), name="get")
 class BlogView(ListView):
     queryset = models.Post.objects.filter(published_at__isnull=False).order_by(
         "-published_at"
@@ -331,11 +426,22 @@ class BlogView(ListView):
         return context
 
 
+@method_decorator(
+    caching.cache_anonymous_page(models.Post, models.User), name="dispatch"
+)
+@method_decorator(
+    caching.conditional_page(
+        models.Post, lookup="slug", related={models.User: "post__slug"}
+    ),
+    name="get",
+)
 class PostView(DetailView):
     model = models.Post
     template_name = "main/post.html"
 
 
+@caching.cache_anonymous_page(models.Incident)
+@caching.conditional_page(models.Incident)
 def coc(request):
     return render(
         request,
@@ -373,80 +479,31 @@ class Broadcast(mixins.SuperuserRequiredMixin, FormView):
         context["subscriptions_list"] = models.Subscription.objects.all().order_by(
             "created_at",
         )
+        context["job_list"] = models.BroadcastJob.objects.annotate(
+            sent_count=Count("records", filter=Q(records__sent_at__isnull=False)),
+            failed_count=Count("records", filter=Q(records__failed_at__isnull=False)),
+        )[:10]
         return context
 
     def post(self, request, *args, **kwargs):
         form_class = self.get_form_class()
         form = self.get_form(form_class)
         if form.is_valid():
-            # list of messages to sent out
-            message_list = []
-            record_ids = []
-
-            # get all subscriptions
-            subscription_list = models.Subscription.objects.all()
-            # if dry run, override and sent only to broadcast preview email
-            if form.cleaned_data.get("dry_run"):
-                subscription_list = [
-                    models.Subscription(email=settings.EMAIL_BROADCAST_PREVIEW)
-                ]
-
-            for subscription in subscription_list:
-                unsubscribe_url = (
-                    utils.get_protocol() + subscription.get_unsubscribe_url()
-                )
-                body = form.cleaned_data.get("body") + utils.get_email_body_footer(
-                    unsubscribe_url
-                )
-
-                # initialise email record
-                email_record = models.EmailRecord.objects.create(
-                    email=subscription.email,
-                    subject=form.cleaned_data.get("subject"),
-                    body=body,
-                    sent_at=None,
-                )
-                if not form.cleaned_data.get("dry_run"):
-                    # in dry run case, there is no subscription object for the email record
-                    # (there is a subscription but we create it temporarily and we don't save it)
-                    email_record.subscription = subscription
-                    email_record.save()
-                record_ids.append(email_record.id)
-
-                # create email message
-                email = mail.EmailMessage(
-                    subject=form.cleaned_data.get("subject"),
-                    body=body,
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    to=[subscription.email],
-                    reply_to=[settings.DEFAULT_FROM_EMAIL],
-                    headers={
-                        "X-PM-Message-Stream": settings.EMAIL_POSTMARK_HEADER,
-                        "List-Unsubscribe": unsubscribe_url,
-                        "List-Unsubscribe-Post": "List-Unsubscribe=One-Click",
-                    },
-                    attachments=utils.get_email_attachments(
-                        form.cleaned_data.get("ics_attachment")
-                    ),
-                )
-                message_list.append(email)
-
-            # send out emails
-            connection = mail.get_connection(
-                "django.core.mail.backends.smtp.EmailBackend",
-                # override email host because we use a different one for non-transactional emails
-                host=settings.EMAIL_HOST_BROADCASTS,
-            )
-            connection.send_messages(message_list)
-            models.EmailRecord.objects.filter(id__in=record_ids).update(
-                sent_at=timezone.now()
+            # sent by run_mail_worker, too slow for a request
+            broadcasts.enqueue_broadcast(
+                subject=form.cleaned_data.get("subject"),
+                body=form.cleaned_data.get("body"),
+                workshop=form.cleaned_data.get("ics_attachment"),
+                dry_run=form.cleaned_data.get("dry_run"),
             )
-            messages.success(request, f"{len(message_list)} emails sent.")
+            messages.success(request, "Broadcast queued.")
             return self.form_valid(form)
         else:
             return self.form_invalid(form)
 
 
+@method_decorator(caching.cache_anonymous_page(models.Mentorship), name="dispatch")
+@method_decorator(caching.conditional_page(models.Mentorship), name="get")
 class MentorshipList(ListView):
     queryset = models.Mentorship.objects.all().order_by("slug")
 
@@ -461,32 +518,48 @@ class MentorshipList(ListView):
         return context
 
 
+@method_decorator(
+    caching.conditional_page(
+        models.Mentorship, lookup="slug", related={models.User: "mentorship__slug"}
+    ),
+    name="get",
+)
 class MentorshipDetail(DetailView):
     model = models.Mentorship
 
 
 def image_raw(request, slug, extension):
+    # bytes of file-backed images are never loaded from the database
     image = models.Image.objects.filter(slug=slug).first()
     if not image or extension != image.extension:
         raise Http404()
-    return HttpResponse(image.data, content_type="image/" + image.extension)
+    variant, negotiated = variants.select_variant(request, image)
+    response = images.serve_image(request, variant)
+    if negotiated:
+        patch_vary_headers(response, ["Accept"])
+    return response
 
 
+@method_decorator(csrf_exempt, name="dispatch")
 class ImageUpload(LoginRequiredMixin, FormView):
     form_class = forms.UploadImagesForm
     template_name = "main/image_upload.html"
+    paginate_by = 50
 
     def get_success_url(self, obj):
         return utils.get_protocol() + obj.get_absolute_url()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["images"] = models.Image.objects.all()
+        paginator = Paginator(models.Image.objects.all(), self.paginate_by)
+        context["page_obj"] = paginator.get_page(self.request.GET.get("page"))
         return context
 
     def post(self, request, *args, **kwargs):
         form_class = self.get_form_class()
         form = self.get_form(form_class)
+        if getattr(request, "rejected_uploads", None):
+            form.add_error("file", "File too big. Limit is 1MB.")
         if form.is_valid():
             return self.form_valid(form)
         else:
@@ -494,31 +567,53 @@ class ImageUpload(LoginRequiredMixin, FormView):
 
     def form_valid(self, form):
         files = form.cleaned_data["file"]
+        # file limit 1MB, normally enforced while receiving the upload, checked
+        # for every file before any of them is stored
+        if any(f.size > settings.IMAGE_UPLOAD_MAX_SIZE for f in files):
+            form.add_error("file", "File too big. Limit is 1MB.")
+            return self.form_invalid(form)
+
+        new_images = []
+        images_by_hash = {}
         for f in files:
             name_ext_parts = f.name.rsplit(".", 1)
             name = name_ext_parts[0].replace(".", "-")
             self.extension = name_ext_parts[1].casefold()
             if self.extension == "jpg":
                 self.extension = "jpeg"
-            data = f.read()
 
-            # file limit 1MB
-            if len(data) > 1000 * 1000:
-                form.add_error("file", "File too big. Limit is 1MB.")
-                return self.form_invalid(form)
+            sha256 = images.hash_uploaded_file(f)
+            key = (sha256, self.extension)
+            obj = images_by_hash.get(key)
+            if obj is None:
+                # re-uploads return the image uploaded first
+                obj = models.Image.objects.filter(
+                    sha256=sha256, extension=self.extension
+                ).first()
+            if obj is None:
+                path = images.store_image_file(f, sha256, self.extension)
+                self.slug = str(uuid.uuid4())[:8]
+                obj = models.Image(
+                    name=name,
+                    path=path,
+                    sha256=sha256,
+                    size=f.size,
+                    extension=self.extension,
+                    slug=self.slug,
+                )
+                new_images.append(obj)
+            images_by_hash[key] = obj
 
-            self.slug = str(uuid.uuid4())[:8]
-            obj = models.Image.objects.create(
-                name=name,
-                data=data,
-                extension=self.extension,
-                slug=self.slug,
-            )
+        with transaction.atomic():
+            models.Image.objects.bulk_create(new_images)
+            variants.schedule_variants([obj.pk for obj in new_images])
         return HttpResponseRedirect(self.get_success_url(obj))
 
     def dispatch(self, request, *args, **kwargs):
         if request.user.is_authenticated and request.user.is_superuser:
-            return super().dispatch(request, *args, **kwargs)
+            # installed before the CSRF check reads the request body
+            request.upload_handlers.insert(0, images.UploadSizeLimitHandler(request))
+            return csrf_protect(super().dispatch)(request, *args, **kwargs)
         raise PermissionDenied()
 
 
@@ -533,5 +628,7 @@ def confirm(request, slug):
     return redirect("workshop", slug=slug)
 
 
+@method_decorator(caching.cache_anonymous_page(models.Incident), name="dispatch")
+@method_decorator(caching.conditional_page(models.Incident, lookup="pk"), name="get")
 class IncidentDetail(DetailView):
     model = models.Incident